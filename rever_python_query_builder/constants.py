@@ -12,3 +12,14 @@ order_mapping = {
     'asc': asc,
     'desc': desc,
 }
+
+time_bucket_granularities = ['hour', 'day', 'week']
+
+aggregate_function_names = {
+    'count': 'count',
+    'sum': 'sum',
+    'average': 'avg',
+    'first': 'first',
+}
+
+nulls_largest_dialects = {'postgresql', 'oracle', 'snowflake'}
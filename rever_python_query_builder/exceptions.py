@@ -0,0 +1,19 @@
+class QueryCostExceededError(Exception):
+
+    def __init__(self, estimate):
+        super().__init__(
+            f"Query estimate exceeds cost limits: {estimate}",
+        )
+        self.estimate = estimate
+
+
+class QueryTimeoutError(Exception):
+    pass
+
+
+class QueryCancelledError(Exception):
+    pass
+
+
+class IncrementalStateConflictError(Exception):
+    pass
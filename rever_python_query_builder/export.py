@@ -0,0 +1,318 @@
+import csv
+import os
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from time import monotonic
+from typing import Any, Callable, Optional
+from uuid import uuid4
+
+from sqlalchemy import event
+from sqlalchemy.types import TypeEngine
+
+from rever_python_query_builder.timeouts import CancellationToken
+from rever_python_query_builder.types import ExportFormat, ExportMetrics
+
+end_of_stream = object()
+
+
+class CsvBatchWriter:
+
+    def __init__(
+        self,
+        path: str,
+        columns: list[str],
+        column_types: list[TypeEngine],
+    ):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, rows: list[Any]) -> None:
+        self.writer.writerows(rows)
+
+    def get_size(self) -> int:
+        return self.file.tell()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def abort(self) -> None:
+        self.file.close()
+
+
+def get_arrow_type(pyarrow: Any, column_type: TypeEngine) -> Any:
+    try:
+        python_type = column_type.python_type
+    except NotImplementedError:
+        return None
+    if python_type is Decimal:
+        precision = getattr(column_type, 'precision', None)
+        scale = getattr(column_type, 'scale', None)
+        if precision is None or scale is None:
+            return None
+        return pyarrow.decimal128(precision, scale)
+    if python_type is datetime:
+        timezone = 'UTC' if getattr(column_type, 'timezone', False) else None
+        return pyarrow.timestamp('us', tz=timezone)
+    arrow_types = {
+        bool: pyarrow.bool_(),
+        int: pyarrow.int64(),
+        float: pyarrow.float64(),
+        str: pyarrow.string(),
+        bytes: pyarrow.binary(),
+        date: pyarrow.date32(),
+        time: pyarrow.time64('us'),
+        timedelta: pyarrow.duration('us'),
+    }
+    return arrow_types.get(python_type)
+
+
+class ParquetBatchWriter:
+
+    # Batches held back while untyped columns are still all NULL. Columns
+    # without a value by then are written as strings.
+    schema_batches = 10
+
+    def __init__(
+        self,
+        path: str,
+        columns: list[str],
+        column_types: list[TypeEngine],
+    ):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as error:
+            raise ImportError(
+                'Parquet export requires pyarrow: '
+                'pip install rever-sql-query-builder[parquet]',
+            ) from error
+        self.pyarrow = pyarrow
+        self.parquet = pyarrow.parquet
+        self.path = path
+        self.columns = columns
+        self.arrow_types = [
+            get_arrow_type(pyarrow, column_type)
+            for column_type in column_types
+        ]
+        self.string_columns: set[int] = set()
+        self.pending: list[list[Any]] = []
+        self.writer = None
+
+    def resolve_types(self, rows: list[Any]) -> None:
+        for index, arrow_type in enumerate(self.arrow_types):
+            if arrow_type is not None:
+                continue
+            values = [row[index] for row in rows if row[index] is not None]
+            if values:
+                self.arrow_types[index] = self.widen(
+                    self.pyarrow.array(values).type,
+                )
+
+    def widen(self, arrow_type: Any) -> Any:
+        # An inferred decimal is only as wide as this batch's largest value;
+        # sums in later batches can be wider.
+        if self.pyarrow.types.is_decimal(arrow_type):
+            return self.pyarrow.decimal128(38, arrow_type.scale)
+        return arrow_type
+
+    def open(self) -> None:
+        for index, arrow_type in enumerate(self.arrow_types):
+            if arrow_type is None:
+                self.arrow_types[index] = self.pyarrow.string()
+                self.string_columns.add(index)
+        self.schema = self.pyarrow.schema(
+            list(zip(self.columns, self.arrow_types)),
+        )
+        self.writer = self.parquet.ParquetWriter(self.path, self.schema)
+        for rows in self.pending:
+            self.write_table(rows)
+        self.pending = []
+
+    def write_table(self, rows: list[Any]) -> None:
+        data = {}
+        for index, column in enumerate(self.columns):
+            values = [row[index] for row in rows]
+            if index in self.string_columns:
+                values = [
+                    None if value is None else str(value) for value in values
+                ]
+            data[column] = values
+        table = self.pyarrow.Table.from_pydict(data, schema=self.schema)
+        # One row group per batch keeps writer memory at one batch.
+        self.writer.write_table(table, row_group_size=len(rows))
+
+    def write(self, rows: list[Any]) -> None:
+        if self.writer is not None:
+            self.write_table(rows)
+            return
+        self.pending.append(rows)
+        self.resolve_types(rows)
+        if (
+            None not in self.arrow_types
+            or len(self.pending) >= self.schema_batches
+        ):
+            self.open()
+
+    def get_size(self) -> int:
+        if self.writer is None:
+            return 0
+        return os.path.getsize(self.path)
+
+    def close(self) -> None:
+        if self.writer is None:
+            self.open()
+        self.writer.close()
+
+    def abort(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+WRITERS = {
+    'csv': CsvBatchWriter,
+    'parquet': ParquetBatchWriter,
+}
+
+
+def put_batch(batches: Queue, item: Any, stopped: Event) -> bool:
+    # Blocks while the writer is behind, which is what bounds memory.
+    while not stopped.is_set():
+        try:
+            batches.put(item, timeout=0.1)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def read_batches(
+    builder: Any,
+    batch_size: int,
+    batches: Queue,
+    stopped: Event,
+    cancellation_token: CancellationToken,
+) -> None:
+    try:
+        with builder.engine.connect() as connection:
+            connection = connection.execution_options(
+                stream_results=True,
+                max_row_buffer=batch_size,
+            )
+            cancellation_token.bind(connection)
+            event.listen(
+                connection,
+                'before_cursor_execute',
+                cancellation_token.on_cursor_execute,
+            )
+            try:
+                query = builder.build()
+                result = connection.execute(query)
+                header = (
+                    list(result.keys()),
+                    [column.type for column in query.selected_columns],
+                )
+                if not put_batch(batches, header, stopped):
+                    return
+                for partition in result.partitions(batch_size):
+                    if not put_batch(batches, partition, stopped):
+                        return
+            finally:
+                cancellation_token.unbind()
+                event.remove(
+                    connection,
+                    'before_cursor_execute',
+                    cancellation_token.on_cursor_execute,
+                )
+    except Exception as error:
+        put_batch(batches, error, stopped)
+        return
+    put_batch(batches, end_of_stream, stopped)
+
+
+def get_batch(batches: Queue, reader: Thread) -> Any:
+    while True:
+        try:
+            return batches.get(timeout=0.1)
+        except Empty:
+            if not reader.is_alive():
+                break
+    # The reader may have queued its last item right before exiting.
+    try:
+        return batches.get_nowait()
+    except Empty:
+        return end_of_stream
+
+
+def export(
+    builder: Any,
+    path: str,
+    export_format: ExportFormat = 'csv',
+    batch_size: int = 10000,
+    max_pending_batches: int = 2,
+    on_batch: Optional[Callable[[ExportMetrics], None]] = None,
+    cancellation_token: Optional[CancellationToken] = None,
+) -> ExportMetrics:
+    writer_class = WRITERS[export_format]
+    token = cancellation_token or CancellationToken()
+    batches: Queue = Queue(maxsize=max_pending_batches)
+    stopped = Event()
+    reader = Thread(
+        target=read_batches,
+        args=(builder, batch_size, batches, stopped, token),
+        daemon=True,
+    )
+    metrics: ExportMetrics = {
+        'rows': 0,
+        'batches': 0,
+        'bytes': 0,
+        'seconds': 0.0,
+        'rows_per_second': 0.0,
+    }
+    # Written next to the destination and moved into place on success, so
+    # a failed or cancelled export never leaves a truncated file at path.
+    temp_path = f'{path}.{uuid4().hex}.part'
+    started = monotonic()
+    reader.start()
+    writer = None
+    try:
+        header = get_batch(batches, reader)
+        if isinstance(header, Exception):
+            raise header
+        writer = writer_class(temp_path, *header)
+        while True:
+            batch = get_batch(batches, reader)
+            if batch is end_of_stream:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            writer.write(batch)
+            metrics['rows'] += len(batch)
+            metrics['batches'] += 1
+            metrics['bytes'] = writer.get_size()
+            update_timing(metrics, started)
+            if on_batch is not None:
+                on_batch(metrics)
+        writer.close()
+    except BaseException:
+        stopped.set()
+        token.cancel()
+        if writer is not None:
+            writer.abort()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        reader.join()
+    os.replace(temp_path, path)
+    metrics['bytes'] = os.path.getsize(path)
+    update_timing(metrics, started)
+    return metrics
+
+
+def update_timing(metrics: ExportMetrics, started: float) -> None:
+    metrics['seconds'] = monotonic() - started
+    if metrics['seconds']:
+        metrics['rows_per_second'] = metrics['rows'] / metrics['seconds']
@@ -0,0 +1,190 @@
+from threading import Lock
+from typing import Any, Optional
+
+from sqlalchemy import and_, func, select
+
+from rever_python_query_builder.cost_guard import get_fingerprint
+from rever_python_query_builder.exceptions import (
+    IncrementalStateConflictError,
+)
+from rever_python_query_builder.scatter_gather import (
+    MERGEABLE_AGGREGATES,
+    build_partial_builder,
+    combine_rows,
+    finalize_rows,
+    sort_rows,
+)
+from rever_python_query_builder.timeouts import execute_with_timeout
+from rever_python_query_builder.types import AggregateState
+from rever_python_query_builder.util import get_limit
+
+
+class MemoryStateStore:
+
+    def __init__(self):
+        self.lock = Lock()
+        self.states: dict[str, AggregateState] = {}
+
+    def get(
+        self,
+        key: str,
+    ) -> Optional[AggregateState]:
+        return self.states.get(key)
+
+    def compare_and_set(
+        self,
+        key: str,
+        expected_watermark: Any,
+        state: AggregateState,
+    ) -> bool:
+        with self.lock:
+            current = self.states.get(key)
+            current_watermark = current['watermark'] if current else None
+            if current_watermark != expected_watermark:
+                return False
+            self.states[key] = state
+            return True
+
+
+def get_empty_state() -> AggregateState:
+    return {'watermark': None, 'rows': []}
+
+
+class IncrementalAggregator:
+
+    max_attempts = 5
+
+    def __init__(
+        self,
+        builder: Any,
+        watermark_column: str,
+        state_store: Optional[Any] = None,
+        key: Optional[str] = None,
+    ):
+        if not any(
+            name in MERGEABLE_AGGREGATES for name, _ in builder.operations
+        ):
+            raise ValueError(
+                'Incremental mode requires count, sum, average or first '
+                'aggregates',
+            )
+        self.builder = builder
+        self.watermark_column = watermark_column
+        self.state_store = state_store or MemoryStateStore()
+        self.partial, self.aggregates = build_partial_builder(builder)
+        compiled = self.partial.query.compile()
+        self.key = key or get_fingerprint(
+            f'{builder.engine.url}\n{watermark_column}\n{compiled}\n'
+            f'{sorted(compiled.params.items())}',
+        )
+
+    def get_high_watermark(self, connection) -> Any:
+        column = self.builder._get_column(self.watermark_column)
+        return connection.execute(
+            select(func.max(column)).select_from(column.table),
+        ).scalar()
+
+    def refresh(self) -> list[dict]:
+        for _ in range(self.max_attempts):
+            state = self.state_store.get(self.key) or get_empty_state()
+            with self.builder.engine.connect() as connection:
+                high_watermark = self.get_high_watermark(connection)
+                if high_watermark == state['watermark']:
+                    new_state = state
+                else:
+                    new_state = self.advance(
+                        connection,
+                        state,
+                        high_watermark,
+                    )
+                tail = self.get_tail(connection, high_watermark)
+            # Another refresh may have merged the same delta meanwhile; only
+            # the first one to move the watermark wins, the rest start over.
+            if new_state is state or self.state_store.compare_and_set(
+                self.key,
+                state['watermark'],
+                new_state,
+            ):
+                return self.get_result(new_state, tail)
+        raise IncrementalStateConflictError(
+            f'State {self.key} kept changing during refresh',
+        )
+
+    def advance(
+        self,
+        connection,
+        state: AggregateState,
+        high_watermark: Any,
+    ) -> AggregateState:
+        base = state
+        if high_watermark is None or (
+            state['watermark'] is not None
+            and high_watermark < state['watermark']
+        ):
+            # The table was truncated or reloaded: rebuild from scratch.
+            base = get_empty_state()
+        if high_watermark is None:
+            return base
+        return {
+            'watermark': high_watermark,
+            'rows': combine_rows(
+                base['rows'] + self.get_delta(
+                    connection,
+                    base['watermark'],
+                    high_watermark,
+                ),
+                self.aggregates,
+            ),
+        }
+
+    def get_delta(
+        self,
+        connection,
+        low_watermark: Any,
+        high_watermark: Any,
+    ) -> list[dict]:
+        column = self.partial._get_column(self.watermark_column)
+        # The state only covers rows below its watermark: rows tied with the
+        # current maximum can still be appended (timestamps), so they are
+        # re-read by every refresh until a higher value shows up.
+        window = column < high_watermark
+        if low_watermark is not None:
+            window = and_(column >= low_watermark, window)
+        return self.get_rows(connection, window)
+
+    def get_tail(
+        self,
+        connection,
+        high_watermark: Any,
+    ) -> list[dict]:
+        if high_watermark is None:
+            return []
+        column = self.partial._get_column(self.watermark_column)
+        return self.get_rows(connection, column == high_watermark)
+
+    def get_rows(
+        self,
+        connection,
+        window: Any,
+    ) -> list[dict]:
+        rows = execute_with_timeout(
+            connection,
+            self.partial.query.where(window),
+            self.builder.timeout,
+        )
+        return [dict(row._mapping) for row in rows]
+
+    def get_result(
+        self,
+        state: AggregateState,
+        tail: list[dict],
+    ) -> list[dict]:
+        operations = self.builder.operations
+        rows = combine_rows(state['rows'] + tail, self.aggregates)
+        rows = sort_rows(
+            finalize_rows(rows, self.aggregates),
+            operations,
+            self.builder.engine.dialect.name,
+        )
+        limit = get_limit(operations)
+        return rows if limit is None else rows[:limit]
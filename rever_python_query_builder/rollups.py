@@ -0,0 +1,180 @@
+from typing import Any, Optional
+
+from sqlalchemy import func, text
+from sqlalchemy.sql.selectable import Select
+
+from rever_python_query_builder.constants import time_bucket_granularities
+from rever_python_query_builder.types import Expression, RollupTable
+from rever_python_query_builder.util import (
+    get_aggregate_outputs,
+    get_value,
+    is_aligned,
+)
+
+Operation = tuple[str, tuple[Any, ...]]
+
+ROLLUP_AGGREGATES = {'count', 'sum'}
+
+ROLLUP_FILTERS = {
+    'where',
+    'and_where',
+    'or_where',
+    'complex_expression',
+    'add_arrays_filter',
+}
+
+
+def measure_key(aggregate: str, column: str) -> str:
+    return f'{aggregate}({column})'
+
+
+def get_expression_fields(expression: Expression) -> set[str]:
+    if 'field' in expression:
+        return {get_value(expression, 'field')}
+    fields = set()
+    for sub_expression in get_value(expression, 'expressions') or []:
+        fields |= get_expression_fields(sub_expression)
+    return fields
+
+
+def get_operation_fields(operation: Operation) -> set[str]:
+    name, args = operation
+    if name in {'and_where', 'or_where'}:
+        fields = set()
+        for expression in args[0]:
+            fields |= get_expression_fields(expression)
+        return fields
+    if name == 'complex_expression':
+        return get_expression_fields(args[0])
+    if name == 'select':
+        return set(args[0])
+    if name in {
+        'select_column',
+        'where',
+        'group_by',
+        'add_arrays_filter',
+        'time_range',
+        'time_bucket',
+    }:
+        return {args[0]}
+    return set()
+
+
+def covers_time_operation(
+    rollup: RollupTable,
+    operation: Operation,
+) -> bool:
+    granularity = get_value(rollup, 'granularity')
+    if granularity is None:
+        return True
+    name, args = operation
+    if name == 'time_range':
+        _, start, end = args
+        return is_aligned(start, granularity) and is_aligned(end, granularity)
+    requested = time_bucket_granularities.index(args[1])
+    return requested >= time_bucket_granularities.index(granularity)
+
+
+def covers(
+    rollup: RollupTable,
+    operations: list[Operation],
+) -> bool:
+    dimensions = set(get_value(rollup, 'dimensions'))
+    measures = get_value(rollup, 'measures')
+    aliases = {output for _, output in get_aggregate_outputs(operations)}
+    has_aggregate = False
+    for operation in operations:
+        name, args = operation
+        if name in ROLLUP_AGGREGATES:
+            column, _ = args
+            if measure_key(name, column) not in measures:
+                return False
+            has_aggregate = True
+        elif name == 'select' and args[0] == '*':
+            return False
+        elif name in {'time_range', 'time_bucket'}:
+            if not (
+                get_operation_fields(operation) <= dimensions
+                and covers_time_operation(rollup, operation)
+            ):
+                return False
+            if name == 'time_bucket':
+                aliases.add(args[2] or args[1])
+        elif name in ROLLUP_FILTERS or name in {
+            'select',
+            'select_column',
+            'group_by',
+        }:
+            if not get_operation_fields(operation) <= dimensions:
+                return False
+        elif name not in {'order_by', 'limit'}:
+            return False
+    order_fields = {
+        args[0] for name, args in operations if name == 'order_by'
+    }
+    return has_aggregate and order_fields <= dimensions | aliases
+
+
+class RollupRegistry:
+
+    def __init__(self):
+        self.rollups: dict[str, list[RollupTable]] = {}
+
+    def register(
+        self,
+        rollup: RollupTable,
+    ) -> 'RollupRegistry':
+        source_table = get_value(rollup, 'source_table')
+        self.rollups.setdefault(source_table, []).append(rollup)
+        return self
+
+    def find(
+        self,
+        source_table: str,
+        operations: list[Operation],
+    ) -> Optional[RollupTable]:
+        candidates = [
+            rollup for rollup in self.rollups.get(source_table, [])
+            if covers(rollup, operations)
+        ]
+        if not candidates:
+            return None
+        # Fewer dimensions means fewer rows, so prefer the coarsest rollup.
+        return min(
+            candidates,
+            key=lambda rollup: len(get_value(rollup, 'dimensions')),
+        )
+
+
+def add_routed_count(routed: Any, measure: str, output: str) -> None:
+    # Partial counts roll up by summing, but sum() over no rows is NULL
+    # where count() would have been 0.
+    routed.selected_columns.append(
+        func.coalesce(func.sum(text(measure)), 0).label(output),
+    )
+    routed.query = routed.query.with_only_columns(*routed.selected_columns)
+
+
+def build_rollup_query(builder: Any, rollup: RollupTable) -> Select:
+    routed = type(builder)(
+        get_value(rollup, 'schema'),
+        get_value(rollup, 'table_name'),
+        builder.engine,
+        builder.metadata,
+        partition_column=get_value(rollup, 'partition_column'),
+    )
+    measures = get_value(rollup, 'measures')
+    outputs = iter(get_aggregate_outputs(builder.operations))
+    for name, args in builder.operations:
+        if name in ROLLUP_AGGREGATES:
+            column, _ = args
+            _, output = next(outputs)
+            measure = measures[measure_key(name, column)]
+            if name == 'count':
+                add_routed_count(routed, measure, output)
+            else:
+                # Partial sums roll up by summing.
+                routed.sum(measure, output)
+        else:
+            getattr(routed, name)(*args)
+    return routed.query
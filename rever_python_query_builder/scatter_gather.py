@@ -0,0 +1,250 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Sequence
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql.selectable import Select
+
+from rever_python_query_builder.timeouts import execute_with_timeout
+from rever_python_query_builder.constants import nulls_largest_dialects
+from rever_python_query_builder.util import get_aggregate_outputs, get_limit
+
+MERGEABLE_AGGREGATES = {'count', 'sum', 'average', 'first'}
+
+
+def get_organization_ids(operations) -> set[str]:
+    organization_ids = set()
+    for name, args in operations:
+        if name != 'where' or args[0] != 'organization_id':
+            continue
+        _, operator, value = args
+        if operator == '=':
+            organization_ids.add(value)
+        elif operator == 'in':
+            organization_ids.update(value)
+    return organization_ids
+
+
+def is_grouped(operations) -> bool:
+    return any(
+        name in MERGEABLE_AGGREGATES or name in {'group_by', 'time_bucket'}
+        for name, _ in operations
+    )
+
+
+def get_partial_keys(output: str) -> tuple[str, str]:
+    return f'__{output}_sum', f'__{output}_count'
+
+
+def add_partial_aggregate(
+    partial: Any,
+    name: str,
+    column: str,
+    output: str,
+) -> None:
+    if name == 'average':
+        sum_key, count_key = get_partial_keys(output)
+        partial.sum(column, sum_key).count(column, count_key)
+    else:
+        # Labelled so partial rows always use the merged column names.
+        getattr(partial, name)(column, output)
+
+
+def build_partial_builder(builder: Any) -> tuple[Any, list[tuple[str, str]]]:
+    partial = type(builder)(
+        builder.schema,
+        builder.table.name,
+        builder.engine,
+        builder.metadata,
+        rollup_registry=builder.rollup_registry,
+        partition_column=builder.partition_column,
+    )
+    aggregates = get_aggregate_outputs(builder.operations)
+    outputs = iter(aggregates)
+    grouped = is_grouped(builder.operations)
+    for name, args in builder.operations:
+        if name in MERGEABLE_AGGREGATES:
+            _, output = next(outputs)
+            add_partial_aggregate(partial, name, args[0], output)
+        elif name in {'order_by', 'limit'} and grouped:
+            # Groups can span engines, so only the merged result is ordered
+            # and limited.
+            continue
+        else:
+            getattr(partial, name)(*args)
+    return partial, aggregates
+
+
+def add_values(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    return left + right
+
+
+def combine_rows(
+    rows: Sequence[dict],
+    aggregates: list[tuple[str, str]],
+) -> list[dict]:
+    aggregate_keys = set()
+    for name, output in aggregates:
+        if name == 'average':
+            aggregate_keys.update(get_partial_keys(output))
+        else:
+            aggregate_keys.add(output)
+    groups: dict[tuple, dict] = {}
+    for row in rows:
+        key = tuple(
+            (column, value) for column, value in row.items()
+            if column not in aggregate_keys
+        )
+        merged = groups.get(key)
+        if merged is None:
+            groups[key] = dict(row)
+            continue
+        for name, output in aggregates:
+            if name == 'first':
+                if merged[output] is None:
+                    merged[output] = row[output]
+                continue
+            if name == 'average':
+                columns = get_partial_keys(output)
+            else:
+                columns = (output,)
+            for column in columns:
+                merged[column] = add_values(merged[column], row[column])
+    return list(groups.values())
+
+
+def finalize_rows(
+    rows: Sequence[dict],
+    aggregates: list[tuple[str, str]],
+) -> list[dict]:
+    finalized = []
+    for row in rows:
+        row = dict(row)
+        for name, output in aggregates:
+            if name == 'average':
+                sum_key, count_key = get_partial_keys(output)
+                total, count = row.pop(sum_key), row.pop(count_key)
+                row[output] = total / count if count else None
+        finalized.append(row)
+    return finalized
+
+
+def merge_rows(
+    partials: Sequence[Sequence[dict]],
+    aggregates: list[tuple[str, str]],
+    grouped: bool,
+) -> list[dict]:
+    rows = [row for partial in partials for row in partial]
+    if not grouped:
+        return rows
+    return finalize_rows(combine_rows(rows, aggregates), aggregates)
+
+
+def sort_rows(
+    rows: list[dict],
+    operations,
+    dialect_name: str,
+) -> list[dict]:
+    order_by = [args for name, args in operations if name == 'order_by']
+    # Match the engine's default null placement: some dialects sort NULL
+    # as the largest value, others as the smallest.
+    nulls_largest = dialect_name in nulls_largest_dialects
+    # Stable sorts applied from the last key to the first.
+    for column, order in reversed(order_by):
+        key = column.split('.')[-1]
+        if rows and key not in rows[0]:
+            raise ValueError(
+                f'Cannot order merged rows by {column}: it is not selected',
+            )
+        descending = order == 'desc'
+        non_null = [row for row in rows if row[key] is not None]
+        nulls = [row for row in rows if row[key] is None]
+        non_null.sort(key=lambda row: row[key], reverse=descending)
+        if nulls_largest == descending:
+            rows = nulls + non_null
+        else:
+            rows = non_null + nulls
+    return rows
+
+
+class ScatterGatherExecutor:
+
+    def __init__(
+        self,
+        shards: dict[str, Sequence[Engine]],
+        organization_router: Optional[Callable[[str], str]] = None,
+        health_check: Optional[Callable[[Engine], bool]] = None,
+        max_workers: Optional[int] = None,
+        timeout: Optional[float] = None,
+    ):
+        if not shards:
+            raise ValueError('ScatterGatherExecutor needs at least one shard')
+        self.shards = shards
+        self.organization_router = organization_router
+        self.health_check = health_check
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+    def get_shard_names(
+        self,
+        organization_ids: Optional[set[str]] = None,
+    ) -> list[str]:
+        if not organization_ids or self.organization_router is None:
+            return list(self.shards)
+        return sorted({
+            self.organization_router(organization_id)
+            for organization_id in organization_ids
+        })
+
+    def run_on_shard(
+        self,
+        shard_name: str,
+        query: Select,
+    ) -> list[dict]:
+        engines = [
+            engine for engine in self.shards[shard_name]
+            if self.health_check is None or self.health_check(engine)
+        ]
+        if not engines:
+            raise RuntimeError(f'No healthy engine for shard {shard_name}')
+        for index, engine in enumerate(engines):
+            try:
+                connection = engine.connect()
+            except DBAPIError:
+                # Fail over to the next replica, unless none are left.
+                if index == len(engines) - 1:
+                    raise
+                continue
+            with connection:
+                rows = execute_with_timeout(connection, query, self.timeout)
+            return [dict(row._mapping) for row in rows]
+
+    def execute(
+        self,
+        builder: Any,
+        organization_ids: Optional[set[str]] = None,
+    ) -> list[dict]:
+        operations = builder.operations
+        if organization_ids is None:
+            organization_ids = get_organization_ids(operations)
+        shard_names = self.get_shard_names(organization_ids)
+        partial, aggregates = build_partial_builder(builder)
+        query = partial.build()
+        with ThreadPoolExecutor(
+            max_workers=self.max_workers or len(shard_names),
+        ) as executor:
+            partials = list(executor.map(
+                lambda shard_name: self.run_on_shard(shard_name, query),
+                shard_names,
+            ))
+        rows = sort_rows(
+            merge_rows(partials, aggregates, is_grouped(operations)),
+            operations,
+            builder.engine.dialect.name,
+        )
+        limit = get_limit(operations)
+        return rows if limit is None else rows[:limit]
@@ -1,23 +1,48 @@
 
+from datetime import date, datetime
+from functools import partial
 from typing import Any, Optional, Sequence
 
 from sqlalchemy import (
-    MetaData, Table, and_, func, or_, select, text
+    MetaData, Table, and_, func, literal_column, or_, select, text
 )
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import Engine, Row
 from sqlalchemy.sql.elements import ClauseElement
-from sqlalchemy.sql.selectable import Select
-from sqlalchemy.sql.schema import Table as SQLATable
+from sqlalchemy.sql.selectable import FromClause, Select
+from sqlalchemy.sql.schema import Column, Table as SQLATable
 
 from rever_python_query_builder.types import (
-    OrderDirection, BaseFilters, WhereOperators, Expression, LocationFilters
+    OrderDirection,
+    BaseFilters,
+    WhereOperators,
+    Expression,
+    LocationFilters,
+    TimeGranularity,
 )
+from rever_python_query_builder.cost_guard import CostGuard
+from rever_python_query_builder.incremental import IncrementalAggregator
 from rever_python_query_builder.operators import OPERATORS
+from rever_python_query_builder.rollups import (
+    RollupRegistry,
+    build_rollup_query,
+)
+from rever_python_query_builder.timeouts import (
+    CancellationToken,
+    execute_with_timeout,
+    run_cancellable,
+)
 from rever_python_query_builder.constants import (
     common_supported_filters,
     order_mapping,
+    time_bucket_granularities,
+)
+from rever_python_query_builder.util import (
+    get_aggregate_outputs,
+    get_limit,
+    get_partition_bounds,
+    get_value,
+    to_datetime,
 )
-from rever_python_query_builder.util import get_value
 
 
 class SQLQueryBuilder:
@@ -26,20 +51,150 @@ class SQLQueryBuilder:
 
     order_mapping = order_mapping
 
-    def __init__(self, schema: str, table_name: str, engine: Engine):
-        self.table: SQLATable = Table(
-                table_name,
-                MetaData(),
-                autoload_with=engine,
-                schema=schema,
-            )
-        self.query: Select = select(self.table.columns)
+    join_keys: dict[str, tuple[str, str]] = {}
+
+    partition_columns: dict[str, str] = {}
+
+    def __init__(
+        self,
+        schema: str,
+        table_name: str,
+        engine: Engine,
+        metadata: Optional[MetaData] = None,
+        rollup_registry: Optional[RollupRegistry] = None,
+        partition_column: Optional[str] = None,
+        cost_guard: Optional[CostGuard] = None,
+        timeout: Optional[float] = None,
+    ):
+        self.schema = schema
+        self.engine = engine
+        self.metadata = metadata if metadata is not None else MetaData()
+        self.rollup_registry = rollup_registry
+        self.cost_guard = cost_guard
+        self.timeout = timeout
+        self.partition_column = (
+            partition_column or self.partition_columns.get(table_name)
+        )
+        self.table: SQLATable = self._reflect_table(table_name, schema)
+        self.tables: dict[str, SQLATable] = {table_name: self.table}
+        self.from_clause: FromClause = self.table
+        self.query: Select = select(self.table.columns).select_from(
+            self.from_clause,
+        )
         self.selected_columns: list[Any] = []
+        self.operations: list[tuple[str, tuple[Any, ...]]] = []
+
+    def _record(
+        self,
+        operation: str,
+        *args: Any,
+    ) -> None:
+        self.operations.append((operation, args))
+
+    def _get_aggregate_output(self) -> str:
+        # Unlabelled aggregates get the names SQLAlchemy would generate
+        # (count_1, avg_1, ...) so routed and merged results keep them.
+        return get_aggregate_outputs(self.operations)[-1][1]
+
+    def build(self) -> Select:
+        if self.rollup_registry is None:
+            return self.query
+        rollup = self.rollup_registry.find(
+            self.table.fullname,
+            self.operations,
+        )
+        if rollup is None:
+            return self.query
+        return build_rollup_query(self, rollup)
+
+    def execute(
+        self,
+        timeout: Optional[float] = None,
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> list[Row]:
+        query, engine = self.build(), self.engine
+        if self.cost_guard is not None:
+            query, engine = self.cost_guard.apply(
+                query,
+                engine,
+                get_limit(self.operations),
+            )
+        with engine.connect() as connection:
+            return execute_with_timeout(
+                connection,
+                query,
+                timeout if timeout is not None else self.timeout,
+                cancellation_token,
+            )
+
+    async def execute_async(
+        self,
+        timeout: Optional[float] = None,
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> list[Row]:
+        token = cancellation_token or CancellationToken()
+        return await run_cancellable(
+            partial(self.execute, timeout, token),
+            token,
+        )
+
+    def incremental(
+        self,
+        watermark_column: str,
+        state_store: Optional[Any] = None,
+        key: Optional[str] = None,
+    ) -> IncrementalAggregator:
+        return IncrementalAggregator(self, watermark_column, state_store, key)
+
+    def _reflect_table(
+        self,
+        table_name: str,
+        schema: Optional[str],
+    ) -> SQLATable:
+        return Table(
+            table_name,
+            self.metadata,
+            autoload_with=self.engine,
+            schema=schema,
+        )
+
+    def _get_column(
+        self,
+        field: str,
+    ) -> Column:
+        if '.' in field:
+            table_name, column = field.split('.', 1)
+            return self.tables[table_name].c[column]
+        return self.table.c[field]
+
+    def join(
+        self,
+        table_name: str,
+        on: Optional[tuple[str, str]] = None,
+        schema: Optional[str] = None,
+        is_outer: bool = False,
+    ) -> 'SQLQueryBuilder':
+        self._record('join', table_name, on, schema, is_outer)
+        table = self._reflect_table(table_name, schema or self.schema)
+        self.tables[table_name] = table
+        on = on or self.join_keys.get(table_name)
+        onclause = None
+        if on:
+            local_field, remote_field = on
+            onclause = self._get_column(local_field) == table.c[remote_field]
+        self.from_clause = self.from_clause.join(
+            table,
+            onclause,
+            isouter=is_outer,
+        )
+        self.query = self.query.select_from(self.from_clause)
+        return self
 
     def select(
         self,
         columns: Sequence[str] | str,
     ) -> 'SQLQueryBuilder':
+        self._record('select', columns)
         if columns == '*':
             columns_to_add = [
                 col for col in self.table.columns
@@ -48,9 +203,9 @@ class SQLQueryBuilder:
             self.selected_columns.extend(columns_to_add)
         else:
             columns_to_add = [
-                self.table.columns[col]
+                self._get_column(col)
                 for col in columns
-                if self.table.columns[col] not in self.selected_columns
+                if self._get_column(col) not in self.selected_columns
             ]
             self.selected_columns.extend(columns_to_add)
         self.query = self.query.with_only_columns(*self.selected_columns)
@@ -61,7 +216,8 @@ class SQLQueryBuilder:
         column: str,
         alias: Optional[str] = None,
     ) -> 'SQLQueryBuilder':
-        col_obj = self.table.columns[column]
+        self._record('select_column', column, alias)
+        col_obj = self._get_column(column)
         if alias:
             col_obj = col_obj.label(alias)
         if col_obj not in self.selected_columns:
@@ -75,7 +231,8 @@ class SQLQueryBuilder:
         operator: WhereOperators,
         filter_value: Any = None,
     ) -> 'SQLQueryBuilder':
-        column = self.table.columns[field]
+        self._record('where', field, operator, filter_value)
+        column = self._get_column(field)
         condition_func = self.operators.get(operator)
         condition = condition_func(column, filter_value)
         self.query = self.query.where(condition)
@@ -85,6 +242,7 @@ class SQLQueryBuilder:
         self,
         expressions: list[Expression],
     ) -> 'SQLQueryBuilder':
+        self._record('or_where', expressions)
         conditions = [
             self._build_expression(expression)
             for expression in expressions
@@ -96,6 +254,7 @@ class SQLQueryBuilder:
         self,
         expressions: list[Expression],
     ) -> 'SQLQueryBuilder':
+        self._record('and_where', expressions)
         conditions = [
             self._build_expression(expression)
             for expression in expressions
@@ -107,6 +266,7 @@ class SQLQueryBuilder:
         self,
         expressions: Expression,
     ) -> 'SQLQueryBuilder':
+        self._record('complex_expression', expressions)
         condition_expression = self._build_expression(expressions)
         self.query = self.query.where(condition_expression)
         return self
@@ -117,7 +277,7 @@ class SQLQueryBuilder:
     ) -> ClauseElement:
         if 'field' in expression:
             condition_func = self.operators[expression.get('operator')]
-            column = self.table.c[expression.get('field')]
+            column = self._get_column(expression.get('field'))
             value = get_value(expression, 'value')
             return condition_func(column, value)
 
@@ -132,11 +292,51 @@ class SQLQueryBuilder:
             }[get_value(expression, 'operator')]
             return condition_func(*sub_conditions)
 
+    def time_range(
+        self,
+        field: str,
+        start: datetime | date | str,
+        end: datetime | date | str,
+    ) -> 'SQLQueryBuilder':
+        self._record('time_range', field, start, end)
+        start, end = to_datetime(start), to_datetime(end)
+        conditions = []
+        if field != self.partition_column:
+            column = self._get_column(field)
+            conditions.extend([column >= start, column < end])
+        if self.partition_column:
+            partition = self._get_column(self.partition_column)
+            start_date, end_date = get_partition_bounds(start, end)
+            conditions.extend([partition >= start_date, partition < end_date])
+        self.query = self.query.where(and_(*conditions))
+        return self
+
+    def time_bucket(
+        self,
+        field: str,
+        granularity: TimeGranularity,
+        alias: Optional[str] = None,
+    ) -> 'SQLQueryBuilder':
+        if granularity not in time_bucket_granularities:
+            raise ValueError(f'Unsupported time bucket: {granularity}')
+        self._record('time_bucket', field, granularity, alias)
+        # Inlined so the select and group by expressions stay identical.
+        bucket = func.date_trunc(
+            literal_column(f"'{granularity}'"),
+            self._get_column(field),
+        )
+        select_column = bucket.label(alias or granularity)
+        self.selected_columns.append(select_column)
+        self.query = self.query.with_only_columns(*self.selected_columns)
+        self.query = self.query.group_by(bucket)
+        return self
+
     def order_by(
         self,
         column: str,
         order: OrderDirection,
     ) -> 'SQLQueryBuilder':
+        self._record('order_by', column, order)
         order_function = self.order_mapping[order]
         self.query = self.query.order_by(order_function(text(column)))
         return self
@@ -145,7 +345,8 @@ class SQLQueryBuilder:
         self,
         column: str,
     ) -> 'SQLQueryBuilder':
-        self.query = self.query.group_by(self.table.c[column])
+        self._record('group_by', column)
+        self.query = self.query.group_by(self._get_column(column))
         return self
 
     def count(
@@ -153,9 +354,10 @@ class SQLQueryBuilder:
         column: str,
         alias: Optional[str] = None,
     ) -> 'SQLQueryBuilder':
-        select_column = func.count(text(column))
-        if (alias):
-            select_column = select_column.label(alias)
+        self._record('count', column, alias)
+        select_column = func.count(text(column)).label(
+            self._get_aggregate_output(),
+        )
         if select_column not in self.selected_columns:
             self.selected_columns.append(select_column)
         self.query = self.query.with_only_columns(*self.selected_columns)
@@ -166,9 +368,10 @@ class SQLQueryBuilder:
         column: str,
         alias: Optional[str] = None,
     ) -> 'SQLQueryBuilder':
-        select_column = func.sum(text(column))
-        if (alias):
-            select_column = select_column.label(alias)
+        self._record('sum', column, alias)
+        select_column = func.sum(text(column)).label(
+            self._get_aggregate_output(),
+        )
         if select_column not in self.selected_columns:
             self.selected_columns.append(select_column)
         self.query = self.query.with_only_columns(*self.selected_columns)
@@ -179,10 +382,10 @@ class SQLQueryBuilder:
         column: str,
         alias: Optional[str] = None,
     ) -> 'SQLQueryBuilder':
-        select_column = func.first(text(column))
-
-        if (alias):
-            select_column = select_column.label(alias)
+        self._record('first', column, alias)
+        select_column = func.first(text(column)).label(
+            self._get_aggregate_output(),
+        )
         if select_column not in self.selected_columns:
             self.selected_columns.append(select_column)
 
@@ -193,6 +396,7 @@ class SQLQueryBuilder:
         self,
         limit_value: int,
     ) -> 'SQLQueryBuilder':
+        self._record('limit', limit_value)
         self.query = self.query.limit(limit_value)
         return self
 
@@ -216,8 +420,9 @@ class SQLQueryBuilder:
         column: str,
         array: list[Any],
     ) -> 'SQLQueryBuilder':
+        self._record('add_arrays_filter', column, array)
         self.query = self.query.where(
-            func.arrays_overlap(self.table.c[column], func.array(*array)),
+            func.arrays_overlap(self._get_column(column), func.array(*array)),
         )
         return self
 
@@ -226,9 +431,10 @@ class SQLQueryBuilder:
         column: str,
         alias: Optional[str] = None,
     ) -> 'SQLQueryBuilder':
-        select_column = func.avg(text(column))
-        if alias:
-            select_column = select_column.label(alias)
+        self._record('average', column, alias)
+        select_column = func.avg(text(column)).label(
+            self._get_aggregate_output(),
+        )
         if select_column not in self.selected_columns:
             self.selected_columns.append(select_column)
         self.query = self.query.with_only_columns(*self.selected_columns)
@@ -0,0 +1,285 @@
+import asyncio
+import warnings
+from threading import Lock, Thread, Timer
+from time import monotonic, sleep
+from typing import Any, Callable, Optional
+from uuid import uuid4
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Connection, Row
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql.selectable import Select
+
+from rever_python_query_builder.exceptions import (
+    QueryCancelledError,
+    QueryTimeoutError,
+)
+from rever_python_query_builder.types import CancelOutcome
+
+# Dialect statements that set and reset a server-side timeout. A reset of
+# None means the setting is scoped to the transaction.
+TIMEOUT_STATEMENTS: dict[str, tuple[str, Optional[str]]] = {
+    'postgresql': ('SET LOCAL statement_timeout = {milliseconds}', None),
+    'mysql': (
+        'SET SESSION max_execution_time = {milliseconds}',
+        'SET SESSION max_execution_time = 0',
+    ),
+    'snowflake': (
+        'ALTER SESSION SET STATEMENT_TIMEOUT_IN_SECONDS = {seconds}',
+        'ALTER SESSION UNSET STATEMENT_TIMEOUT_IN_SECONDS',
+    ),
+}
+
+# Statements that tag the session so another connection can find and
+# cancel the running query.
+TAG_STATEMENTS: dict[str, tuple[str, str]] = {
+    'snowflake': (
+        "ALTER SESSION SET QUERY_TAG = '{tag}'",
+        'ALTER SESSION UNSET QUERY_TAG',
+    ),
+}
+
+snowflake_cancel_statement = text(
+    'SELECT SYSTEM$CANCEL_QUERY(query_id) '
+    'FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY_BY_USER()) '
+    'WHERE query_tag = :tag AND execution_status IN '
+    "('RUNNING', 'QUEUED', 'BLOCKED', 'RESUMING_WAREHOUSE')",
+)
+
+
+def cancel_statement(dbapi_connection: Any) -> bool:
+    # psycopg2/asyncpg style cancel() or sqlite3 interrupt().
+    for method in ('cancel', 'interrupt'):
+        if hasattr(dbapi_connection, method):
+            getattr(dbapi_connection, method)()
+            return True
+    return False
+
+
+def cancel_cursor(
+    connection: Connection,
+    cursor: Any,
+    tag: str,
+) -> CancelOutcome:
+    # Databricks and most warehouse drivers only cancel per cursor.
+    if cursor is not None and hasattr(cursor, 'cancel'):
+        cursor.cancel()
+        return 'sent'
+    if cancel_statement(connection.connection.dbapi_connection):
+        return 'sent'
+    return 'unsupported'
+
+
+def cancel_snowflake(
+    connection: Connection,
+    cursor: Any,
+    tag: str,
+) -> CancelOutcome:
+    # The session is busy running the query, so cancel from another one.
+    with connection.engine.connect() as cancel_connection:
+        matched = cancel_connection.execute(
+            snowflake_cancel_statement,
+            {'tag': tag},
+        ).fetchall()
+    return 'cancelled' if matched else 'sent'
+
+
+# Cancellers report 'sent' when the statement may not have started yet and
+# the cancel should be repeated, and 'cancelled' once it is known to have
+# landed.
+CANCELLERS: dict[str, Callable[[Connection, Any, str], CancelOutcome]] = {
+    'snowflake': cancel_snowflake,
+}
+
+
+class CancellationToken:
+
+    cancel_attempts = 50
+
+    cancel_interval = 0.1
+
+    def __init__(self):
+        self.lock = Lock()
+        self.cancelled = False
+        self.timed_out = False
+        self.tag = f'rever-query-{uuid4().hex}'
+        self.connection: Optional[Connection] = None
+        self.cursor: Any = None
+
+    def bind(
+        self,
+        connection: Connection,
+    ) -> None:
+        with self.lock:
+            if self.cancelled:
+                raise QueryCancelledError('Query was cancelled')
+            self.connection = connection
+            self.cursor = None
+
+    def unbind(self) -> None:
+        with self.lock:
+            self.connection = None
+            self.cursor = None
+
+    def on_cursor_execute(
+        self,
+        connection: Connection,
+        cursor: Any,
+        *args: Any,
+    ) -> None:
+        with self.lock:
+            # Refuse to start a statement once cancelled, otherwise a
+            # cancel landing right before execution would be lost.
+            if self.cancelled:
+                raise QueryCancelledError('Query was cancelled')
+            self.cursor = cursor
+
+    def send_cancel(
+        self,
+        connection: Connection,
+        cursor: Any,
+    ) -> CancelOutcome:
+        canceller = CANCELLERS.get(connection.dialect.name, cancel_cursor)
+        try:
+            return canceller(connection, cursor, self.tag)
+        except Exception:
+            with self.lock:
+                if self.connection is connection:
+                    raise
+            # The statement finished and released its cursor while the
+            # cancel was in flight.
+            return 'cancelled'
+
+    def cancel(self) -> None:
+        with self.lock:
+            self.cancelled = True
+            connection, cursor = self.connection, self.cursor
+        if connection is None:
+            return
+        # Sent outside the lock: cancelling can take a round trip (a new
+        # connection on Snowflake) and must not hold up the query thread.
+        outcome = self.send_cancel(connection, cursor)
+        if outcome == 'unsupported':
+            warnings.warn(
+                f'Statements on {connection.dialect.name} cannot be '
+                'cancelled; the query will run to completion',
+                RuntimeWarning,
+            )
+            return
+        if outcome == 'cancelled':
+            return
+        Thread(
+            target=self.repeat_cancel,
+            args=(connection,),
+            daemon=True,
+        ).start()
+
+    def repeat_cancel(
+        self,
+        connection: Connection,
+    ) -> None:
+        # A cancel sent between the cursor being captured and the driver
+        # starting the statement is a no-op, so keep sending it until the
+        # statement is gone or known to be cancelled.
+        for _ in range(self.cancel_attempts):
+            sleep(self.cancel_interval)
+            with self.lock:
+                if self.connection is not connection:
+                    return
+                cursor = self.cursor
+            if self.send_cancel(connection, cursor) == 'cancelled':
+                return
+
+    def expire(self) -> None:
+        self.timed_out = True
+        self.cancel()
+
+
+def execute_with_timeout(
+    connection: Connection,
+    query: Select,
+    timeout: Optional[float] = None,
+    cancellation_token: Optional[CancellationToken] = None,
+) -> list[Row]:
+    token = cancellation_token or CancellationToken()
+    statements = None
+    if timeout:
+        statements = TIMEOUT_STATEMENTS.get(connection.dialect.name)
+    tag_statements = TAG_STATEMENTS.get(connection.dialect.name)
+    watchdog = None
+    if timeout and statements is None:
+        watchdog = Timer(timeout, token.expire)
+        watchdog.daemon = True
+    started = monotonic()
+    token.bind(connection)
+    event.listen(
+        connection,
+        'before_cursor_execute',
+        token.on_cursor_execute,
+    )
+    try:
+        with connection.begin():
+            if tag_statements is not None:
+                connection.execute(
+                    text(tag_statements[0].format(tag=token.tag)),
+                )
+            if statements is not None:
+                connection.execute(text(statements[0].format(
+                    milliseconds=int(timeout * 1000),
+                    seconds=max(int(timeout), 1),
+                )))
+            if watchdog is not None:
+                watchdog.start()
+            rows = connection.execute(query).fetchall()
+    except (DBAPIError, QueryCancelledError) as error:
+        if token.timed_out or (timeout and monotonic() - started >= timeout):
+            raise QueryTimeoutError(
+                f'Query exceeded timeout of {timeout}s',
+            ) from error
+        if token.cancelled:
+            raise QueryCancelledError('Query was cancelled') from error
+        raise
+    finally:
+        if watchdog is not None:
+            watchdog.cancel()
+        token.unbind()
+        event.remove(
+            connection,
+            'before_cursor_execute',
+            token.on_cursor_execute,
+        )
+        if statements is not None and statements[1] is not None:
+            reset_session(connection, statements[1])
+        if tag_statements is not None:
+            reset_session(connection, tag_statements[1])
+    # Drivers that could not be interrupted still never hand back rows of a
+    # cancelled or timed out statement.
+    if token.timed_out:
+        raise QueryTimeoutError(f'Query exceeded timeout of {timeout}s')
+    if token.cancelled:
+        raise QueryCancelledError('Query was cancelled')
+    return rows
+
+
+def reset_session(
+    connection: Connection,
+    statement: str,
+) -> None:
+    try:
+        connection.execute(text(statement))
+    except DBAPIError:
+        # Never hand a pooled connection back with stale session settings.
+        connection.invalidate()
+
+
+async def run_cancellable(
+    func: Callable[[], Any],
+    cancellation_token: CancellationToken,
+) -> Any:
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(None, func)
+    except asyncio.CancelledError:
+        # Cancelling may block on the network, so keep it off the loop.
+        loop.run_in_executor(None, cancellation_token.cancel)
+        raise
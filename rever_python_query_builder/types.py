@@ -1,5 +1,5 @@
 from typing import Literal, Optional
-from typing import Any, List, TypedDict
+from typing import Any, Dict, List, TypedDict
 
 OrderDirection = Literal['asc', 'desc']
 WhereOperators = Literal[
@@ -16,6 +16,11 @@ WhereOperators = Literal[
     '>=',
 ]
 
+TimeGranularity = Literal['hour', 'day', 'week']
+CostAction = Literal['reject', 'limit', 'route']
+ExportFormat = Literal['csv', 'parquet']
+CancelOutcome = Literal['unsupported', 'sent', 'cancelled']
+
 
 class BaseFilters(TypedDict):
     organization_id: str
@@ -34,3 +39,34 @@ class LocationFilters(TypedDict):
     country_codes: Optional[List[str]]
     site_groups: Optional[List[str]]
     tag_groups: Optional[List[str]]
+
+
+class RollupTableBase(TypedDict):
+    table_name: str
+    schema: Optional[str]
+    source_table: str
+    dimensions: List[str]
+    measures: Dict[str, str]
+
+
+class RollupTable(RollupTableBase, total=False):
+    partition_column: Optional[str]
+    granularity: Optional[TimeGranularity]
+
+
+class CostEstimate(TypedDict):
+    rows: Optional[float]
+    bytes: Optional[float]
+
+
+class ExportMetrics(TypedDict):
+    rows: int
+    batches: int
+    bytes: int
+    seconds: float
+    rows_per_second: float
+
+
+class AggregateState(TypedDict):
+    watermark: Any
+    rows: List[Dict[str, Any]]
@@ -1,4 +1,65 @@
+from datetime import datetime, time, timedelta, timezone
+
+from rever_python_query_builder.constants import aggregate_function_names
+
+
 def get_value(obj, key):
     if isinstance(obj, dict):
         return obj.get(key)
     return getattr(obj, key, None)
+
+
+def to_datetime(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        return value
+    return datetime.combine(value, time.min)
+
+
+def to_partition_time(value):
+    # Partitions are daily in UTC; naive values are taken as UTC already.
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc)
+
+
+def get_partition_bounds(start, end):
+    # Half-open [start, end) as dates: the end date only counts when the
+    # range reaches into it.
+    start, end = to_partition_time(start), to_partition_time(end)
+    end_date = end.date()
+    if end.time() != time.min:
+        end_date += timedelta(days=1)
+    return start.date(), end_date
+
+
+def is_aligned(value, granularity):
+    value = to_datetime(value)
+    if value.minute or value.second or value.microsecond:
+        return False
+    if granularity == 'hour':
+        return True
+    if value.hour:
+        return False
+    return granularity == 'day' or value.weekday() == 0
+
+
+def get_aggregate_outputs(operations):
+    outputs = []
+    counters = {}
+    for name, args in operations:
+        if name not in aggregate_function_names:
+            continue
+        _, alias = args
+        if alias is None:
+            function_name = aggregate_function_names[name]
+            counters[function_name] = counters.get(function_name, 0) + 1
+            alias = f'{function_name}_{counters[function_name]}'
+        outputs.append((name, alias))
+    return outputs
+
+
+def get_limit(operations):
+    limits = [args[0] for name, args in operations if name == 'limit']
+    return limits[-1] if limits else None
@@ -9,6 +9,9 @@ setup(
     install_requires=[
         "SQLAlchemy>=1.4"
     ],
+    extras_require={
+        "parquet": ["pyarrow"],
+    },
     license="MIT",
     python_requires=">=3.7",
     url="https://github.com/reverscore/rever-python-query-builder",
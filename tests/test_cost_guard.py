@@ -0,0 +1,254 @@
+import json
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    MetaData,
+    Table,
+    create_engine,
+    func,
+    select,
+)
+from sqlalchemy.dialects import postgresql
+
+from rever_python_query_builder.cost_guard import (
+    CostGuard,
+    compile_for_explain,
+    explain_databricks,
+    explain_postgresql,
+    explain_snowflake,
+)
+from rever_python_query_builder.exceptions import QueryCostExceededError
+from rever_python_query_builder.sql_query_builder import SQLQueryBuilder
+
+
+def mock_connection(plan):
+    connection = MagicMock()
+    connection.exec_driver_sql.return_value.scalar.return_value = plan
+    return connection
+
+
+class TestCostGuard(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        self.low_priority_engine = create_engine('sqlite:///:memory:')
+        self.table = Table(
+            'events',
+            MetaData(),
+            Column('id', Integer, primary_key=True),
+            Column('created_at', DateTime),
+        )
+        self.query = select(self.table.c.id)
+        self.explain_calls = []
+
+    def get_guard(self, rows, **kwargs):
+        guard = CostGuard(**kwargs)
+
+        def explainer(connection, sql, params):
+            self.explain_calls.append((sql, params))
+            return {'rows': rows, 'bytes': rows * 8}
+
+        guard.explainers = {'sqlite': explainer}
+        return guard
+
+    def test_explain_postgresql(self):
+        connection = mock_connection(
+            '[{"Plan": {"Plan Rows": 1000, "Plan Width": 16}}]',
+        )
+        estimate = explain_postgresql(connection, 'SELECT 1', {})
+        self.assertEqual(estimate, {'rows': 1000, 'bytes': 16000})
+
+    def test_explain_postgresql_uses_scan_nodes(self):
+        connection = mock_connection(json.dumps([{'Plan': {
+            'Node Type': 'Aggregate',
+            'Plan Rows': 1,
+            'Plan Width': 8,
+            'Plans': [{
+                'Node Type': 'Hash Join',
+                'Plan Rows': 500,
+                'Plan Width': 12,
+                'Plans': [
+                    {
+                        'Node Type': 'Seq Scan',
+                        'Relation Name': 'events',
+                        'Plan Rows': 2000000,
+                        'Plan Width': 16,
+                    },
+                    {
+                        'Node Type': 'Hash',
+                        'Plan Rows': 10,
+                        'Plan Width': 4,
+                        'Plans': [{
+                            'Node Type': 'Index Scan',
+                            'Relation Name': 'sites',
+                            'Plan Rows': 10,
+                            'Plan Width': 4,
+                        }],
+                    },
+                ],
+            }],
+        }}]))
+        estimate = explain_postgresql(connection, 'SELECT 1', {})
+        self.assertEqual(
+            estimate,
+            {'rows': 2000010, 'bytes': 2000000 * 16 + 10 * 4},
+        )
+
+    def test_explain_snowflake(self):
+        connection = mock_connection(
+            {'GlobalStats': {'bytesAssigned': 2048, 'partitionsTotal': 4}},
+        )
+        estimate = explain_snowflake(connection, 'SELECT 1', {})
+        self.assertEqual(estimate, {'rows': None, 'bytes': 2048})
+
+    def test_explain_databricks(self):
+        connection = mock_connection(
+            '== Optimized Logical Plan ==\n'
+            'Aggregate [count(1)], Statistics(sizeInBytes=16.0 B, '
+            'rowCount=1)\n'
+            '+- Relation events, Statistics(sizeInBytes=3.0 GiB, '
+            'rowCount=2.00E+6)',
+        )
+        estimate = explain_databricks(connection, 'SELECT 1', {})
+        self.assertEqual(
+            estimate,
+            {'rows': 2000000.0, 'bytes': 3.0 * 1024 ** 3},
+        )
+
+    def test_explain_databricks_adds_relations(self):
+        connection = mock_connection(
+            '== Optimized Logical Plan ==\n'
+            'Aggregate [count(1)], Statistics(sizeInBytes=16.0 B)\n'
+            '+- Join Inner, Statistics(sizeInBytes=1.0 GiB)\n'
+            '   :- Relation events, Statistics(sizeInBytes=3.0 GiB)\n'
+            '   +- Relation sites, Statistics(sizeInBytes=1.0 MiB, '
+            'rowCount=10)',
+        )
+        estimate = explain_databricks(connection, 'SELECT 1', {})
+        self.assertEqual(
+            estimate,
+            {'rows': None, 'bytes': 3.0 * 1024 ** 3 + 1024 ** 2},
+        )
+
+    def test_rejects_aggregate_over_large_scan(self):
+        guard = CostGuard(max_rows=10 ** 6)
+        postgresql_engine = MagicMock()
+        postgresql_engine.dialect = postgresql.dialect()
+        postgresql_engine.url = 'postgresql://warehouse'
+        connection = mock_connection(json.dumps([{'Plan': {
+            'Node Type': 'Aggregate',
+            'Plan Rows': 1,
+            'Plan Width': 8,
+            'Plans': [{
+                'Node Type': 'Seq Scan',
+                'Relation Name': 'events',
+                'Plan Rows': 5 * 10 ** 7,
+                'Plan Width': 16,
+            }],
+        }}]))
+        postgresql_engine.connect().__enter__.return_value = connection
+        query = select(func.count(self.table.c.id))
+        with self.assertRaises(QueryCostExceededError) as context:
+            guard.apply(query, postgresql_engine)
+        self.assertEqual(context.exception.estimate['rows'], 5 * 10 ** 7)
+
+    def test_unknown_dialect_passes(self):
+        guard = CostGuard(max_rows=1)
+        self.assertEqual(
+            guard.apply(self.query, self.engine),
+            (self.query, self.engine),
+        )
+
+    def test_rejects_expensive_query(self):
+        guard = self.get_guard(10 ** 9, max_rows=10 ** 6)
+        with self.assertRaises(QueryCostExceededError) as context:
+            guard.apply(self.query, self.engine)
+        self.assertEqual(context.exception.estimate['rows'], 10 ** 9)
+
+    def test_passes_cheap_query(self):
+        guard = self.get_guard(10, max_rows=10 ** 6, max_bytes=10 ** 6)
+        self.assertEqual(
+            guard.apply(self.query, self.engine),
+            (self.query, self.engine),
+        )
+
+    def test_limits_expensive_query(self):
+        guard = self.get_guard(10 ** 9, max_bytes=10 ** 6, action='limit')
+        query, engine = guard.apply(self.query, self.engine)
+        self.assertIn('LIMIT', str(query))
+        self.assertIs(engine, self.engine)
+
+    def test_keeps_smaller_limit(self):
+        guard = self.get_guard(10 ** 9, max_rows=1, action='limit')
+        limited_query = self.query.limit(5)
+        query, _ = guard.apply(limited_query, self.engine, limit=5)
+        self.assertIs(query, limited_query)
+
+    def test_routes_expensive_query(self):
+        guard = self.get_guard(
+            10 ** 9,
+            max_rows=1,
+            action='route',
+            low_priority_engine=self.low_priority_engine,
+        )
+        _, engine = guard.apply(self.query, self.engine)
+        self.assertIs(engine, self.low_priority_engine)
+
+    def test_route_requires_engine(self):
+        with self.assertRaises(ValueError):
+            CostGuard(action='route')
+
+    def test_caches_estimates_by_fingerprint(self):
+        guard = self.get_guard(10, max_rows=100, cache_size=1)
+        guard.apply(self.query, self.engine)
+        guard.apply(select(self.table.c.id), self.engine)
+        self.assertEqual(len(self.explain_calls), 1)
+        guard.apply(self.query.where(self.table.c.id == 1), self.engine)
+        guard.apply(self.query, self.engine)
+        self.assertEqual(len(self.explain_calls), 3)
+
+    def test_caches_by_parameter_values(self):
+        guard = self.get_guard(10, max_rows=100)
+        guard.apply(self.query.where(self.table.c.id == 1), self.engine)
+        guard.apply(self.query.where(self.table.c.id == 2), self.engine)
+        self.assertEqual(len(self.explain_calls), 2)
+
+    def test_compiles_typed_parameters_for_postgresql(self):
+        query = self.query.where(
+            self.table.c.created_at >= datetime(2024, 1, 1),
+        ).where(self.table.c.id.in_([1, 2]))
+        sql, params, _ = compile_for_explain(query, postgresql.dialect())
+        self.assertIn('events.created_at >= %(created_at_1)s', sql)
+        self.assertEqual(params['created_at_1'], datetime(2024, 1, 1))
+        self.assertEqual((params['id_1_1'], params['id_1_2']), (1, 2))
+
+    def test_guards_time_range_query(self):
+        self.table.create(self.engine)
+        query_builder = SQLQueryBuilder(
+            None,
+            'events',
+            self.engine,
+            cost_guard=CostGuard(max_rows=100),
+        )
+        query_builder.count('id', 'total').time_range(
+            'created_at',
+            datetime(2024, 1, 1),
+            datetime(2024, 1, 2),
+        )
+
+        def explain_sqlite(connection, sql, params):
+            plan = connection.exec_driver_sql(
+                f'EXPLAIN QUERY PLAN {sql}',
+                params,
+            ).fetchall()
+            self.explain_calls.append(plan)
+            return {'rows': 10, 'bytes': None}
+
+        query_builder.cost_guard.explainers = {'sqlite': explain_sqlite}
+        self.assertEqual(query_builder.execute()[0].total, 0)
+        self.assertEqual(len(self.explain_calls), 1)
@@ -0,0 +1,205 @@
+import csv
+import os
+import tempfile
+import unittest
+from decimal import Decimal
+from importlib.util import find_spec
+
+from sqlalchemy import create_engine
+from sqlalchemy.types import NullType
+
+from rever_python_query_builder.export import ParquetBatchWriter, export
+from rever_python_query_builder.sql_query_builder import SQLQueryBuilder
+
+has_pyarrow = find_spec('pyarrow') is not None
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        database = os.path.join(self.directory.name, 'events.db')
+        self.engine = create_engine(f'sqlite:///{database}')
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql(
+                'CREATE TABLE events (id INTEGER PRIMARY KEY, name VARCHAR, '
+                'score INTEGER)',
+            )
+            connection.exec_driver_sql(
+                'INSERT INTO events VALUES (?, ?, ?)',
+                [
+                    (index, f'event{index}', index if index > 20 else None)
+                    for index in range(25)
+                ],
+            )
+        self.query_builder = SQLQueryBuilder(None, 'events', self.engine)
+        self.query_builder.select(['id', 'name']).order_by('id', 'asc')
+
+    def get_path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def test_export_csv(self):
+        path = self.get_path('events.csv')
+        progress = []
+        metrics = export(
+            self.query_builder,
+            path,
+            batch_size=10,
+            max_pending_batches=1,
+            on_batch=lambda metrics: progress.append(
+                (metrics['rows'], metrics['bytes']),
+            ),
+        )
+        with open(path, newline='') as file:
+            rows = list(csv.reader(file))
+        self.assertEqual(rows[0], ['id', 'name'])
+        self.assertEqual(rows[1], ['0', 'event0'])
+        self.assertEqual(len(rows), 26)
+        self.assertEqual([rows for rows, _ in progress], [10, 20, 25])
+        sizes = [size for _, size in progress]
+        self.assertTrue(0 < sizes[0] < sizes[1] < sizes[2])
+        self.assertEqual(metrics['rows'], 25)
+        self.assertEqual(metrics['batches'], 3)
+        self.assertEqual(metrics['bytes'], os.path.getsize(path))
+
+    def test_export_empty_result(self):
+        path = self.get_path('empty.csv')
+        self.query_builder.where('id', '<', 0)
+        metrics = export(self.query_builder, path)
+        with open(path, newline='') as file:
+            self.assertEqual(list(csv.reader(file)), [['id', 'name']])
+        self.assertEqual(metrics['rows'], 0)
+
+    def test_export_propagates_query_errors(self):
+        path = self.get_path('broken.csv')
+        self.query_builder.order_by('missing', 'asc')
+        with self.assertRaises(Exception):
+            export(self.query_builder, path)
+
+    def test_writer_errors_stop_reader(self):
+        path = self.get_path('stopped.csv')
+
+        def fail(_):
+            raise RuntimeError('disk full')
+
+        with self.assertRaises(RuntimeError):
+            export(
+                self.query_builder,
+                path,
+                batch_size=5,
+                max_pending_batches=1,
+                on_batch=fail,
+            )
+
+    def test_failed_export_leaves_no_file(self):
+        path = self.get_path('failed.csv')
+
+        def fail(metrics):
+            if metrics['batches'] == 2:
+                raise RuntimeError('disk full')
+
+        with self.assertRaises(RuntimeError):
+            export(self.query_builder, path, batch_size=10, on_batch=fail)
+        self.assertEqual(os.listdir(self.directory.name), ['events.db'])
+
+    @unittest.skipUnless(has_pyarrow, 'pyarrow is not installed')
+    def test_export_parquet(self):
+        import pyarrow.parquet
+
+        path = self.get_path('events.parquet')
+        metrics = export(
+            self.query_builder,
+            path,
+            export_format='parquet',
+            batch_size=10,
+        )
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        self.assertEqual(parquet_file.metadata.num_rows, 25)
+        self.assertEqual(parquet_file.metadata.num_row_groups, 3)
+        self.assertEqual(metrics['batches'], 3)
+
+    @unittest.skipUnless(has_pyarrow, 'pyarrow is not installed')
+    def test_export_parquet_leading_null_column(self):
+        import pyarrow.parquet
+
+        path = self.get_path('scores.parquet')
+        self.query_builder.select(['score'])
+        export(
+            self.query_builder,
+            path,
+            export_format='parquet',
+            batch_size=10,
+        )
+        table = pyarrow.parquet.read_table(path)
+        self.assertEqual(str(table.schema.field('score').type), 'int64')
+        self.assertEqual(table.column('score').to_pylist()[-1], 24)
+
+    @unittest.skipUnless(has_pyarrow, 'pyarrow is not installed')
+    def test_parquet_resolves_untyped_columns_from_later_batches(self):
+        import pyarrow.parquet
+
+        path = self.get_path('untyped.parquet')
+        writer = ParquetBatchWriter(path, ['total'], [NullType()])
+        writer.write([(None,), (None,)])
+        self.assertEqual(writer.get_size(), 0)
+        writer.write([(3,)])
+        writer.close()
+        table = pyarrow.parquet.read_table(path)
+        self.assertEqual(str(table.schema.field('total').type), 'int64')
+        self.assertEqual(table.column('total').to_pylist(), [None, None, 3])
+
+    @unittest.skipUnless(has_pyarrow, 'pyarrow is not installed')
+    def test_parquet_writes_unresolved_columns_as_strings(self):
+        import pyarrow.parquet
+
+        path = self.get_path('unresolved.parquet')
+        writer = ParquetBatchWriter(path, ['total'], [NullType()])
+        writer.schema_batches = 1
+        writer.write([(None,)])
+        writer.write([(3,)])
+        writer.close()
+        table = pyarrow.parquet.read_table(path)
+        self.assertEqual(table.column('total').to_pylist(), [None, '3'])
+
+    @unittest.skipUnless(has_pyarrow, 'pyarrow is not installed')
+    def test_parquet_widens_inferred_decimals(self):
+        import pyarrow.parquet
+
+        path = self.get_path('sums.parquet')
+        writer = ParquetBatchWriter(path, ['total'], [NullType()])
+        writer.write([(Decimal('1.50'),)])
+        writer.write([(Decimal('123456789012.25'),)])
+        writer.close()
+        table = pyarrow.parquet.read_table(path)
+        self.assertEqual(
+            table.column('total').to_pylist(),
+            [Decimal('1.50'), Decimal('123456789012.25')],
+        )
+
+    @unittest.skipUnless(has_pyarrow, 'pyarrow is not installed')
+    def test_failed_parquet_export_leaves_no_file(self):
+        path = self.get_path('failed.parquet')
+        self.query_builder.select(['score'])
+
+        def fail(_):
+            raise RuntimeError('cancelled')
+
+        with self.assertRaises(RuntimeError):
+            export(
+                self.query_builder,
+                path,
+                export_format='parquet',
+                batch_size=10,
+                on_batch=fail,
+            )
+        self.assertEqual(os.listdir(self.directory.name), ['events.db'])
+
+    @unittest.skipIf(has_pyarrow, 'pyarrow is installed')
+    def test_export_parquet_requires_pyarrow(self):
+        with self.assertRaises(ImportError):
+            export(
+                self.query_builder,
+                self.get_path('events.parquet'),
+                export_format='parquet',
+            )
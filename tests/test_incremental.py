@@ -0,0 +1,198 @@
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from rever_python_query_builder.exceptions import (
+    IncrementalStateConflictError,
+)
+from rever_python_query_builder.incremental import MemoryStateStore
+from rever_python_query_builder.sql_query_builder import SQLQueryBuilder
+
+
+class TestIncrementalAggregator(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine(
+            'sqlite:///:memory:',
+            connect_args={'check_same_thread': False},
+            poolclass=StaticPool,
+        )
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql(
+                'CREATE TABLE events (id INTEGER PRIMARY KEY, '
+                'organization_id VARCHAR, site_id VARCHAR, value INTEGER)',
+            )
+        self.insert_events([
+            (1, 'org1', 'site1', 2),
+            (2, 'org1', 'site2', 4),
+            (3, 'org2', 'site1', 8),
+        ])
+        self.state_store = MemoryStateStore()
+
+    def insert_events(self, rows):
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql(
+                'INSERT INTO events VALUES (?, ?, ?, ?)',
+                rows,
+            )
+
+    def get_query_builder(self):
+        query_builder = SQLQueryBuilder(None, 'events', self.engine)
+        return query_builder.select_column('site_id') \
+            .count('id', 'total') \
+            .sum('value', 'total_value') \
+            .average('value', 'avg_value') \
+            .group_by('site_id') \
+            .order_by('site_id', 'asc')
+
+    def get_aggregator(self, query_builder=None):
+        query_builder = query_builder or self.get_query_builder()
+        return query_builder.incremental('id', self.state_store)
+
+    def full_result(self, query_builder=None):
+        query_builder = query_builder or self.get_query_builder()
+        return [dict(row._mapping) for row in query_builder.execute()]
+
+    def test_first_refresh_aggregates_everything(self):
+        aggregator = self.get_aggregator()
+        self.assertEqual(aggregator.refresh(), self.full_result())
+        self.assertEqual(
+            self.state_store.get(aggregator.key)['watermark'],
+            3,
+        )
+
+    def test_refresh_merges_new_rows(self):
+        self.get_aggregator().refresh()
+        self.insert_events([
+            (4, 'org1', 'site1', 5),
+            (5, 'org2', 'site3', 1),
+        ])
+        aggregator = self.get_aggregator()
+        deltas = []
+        get_delta = aggregator.get_delta
+
+        def record_delta(connection, low_watermark, high_watermark):
+            deltas.append((low_watermark, high_watermark))
+            return get_delta(connection, low_watermark, high_watermark)
+
+        aggregator.get_delta = record_delta
+        self.assertEqual(aggregator.refresh(), self.full_result())
+        self.assertEqual(deltas, [(3, 5)])
+
+    def test_refresh_without_new_rows_skips_query(self):
+        aggregator = self.get_aggregator()
+        first_result = aggregator.refresh()
+        aggregator.get_delta = None
+        self.assertEqual(aggregator.refresh(), first_result)
+
+    def test_filters_have_separate_state(self):
+        org1 = self.get_query_builder().add_organization_filter('org1')
+        org2 = self.get_query_builder().add_organization_filter('org2')
+        self.assertNotEqual(
+            self.get_aggregator(org1).key,
+            self.get_aggregator(org2).key,
+        )
+        self.assertEqual(
+            self.get_aggregator(org2).refresh(),
+            self.full_result(org2),
+        )
+
+    def test_applies_limit_after_merge(self):
+        query_builder = self.get_query_builder().limit(1)
+        self.get_aggregator(query_builder).refresh()
+        self.insert_events([(4, 'org1', 'site0', 1)])
+        rows = self.get_aggregator(query_builder).refresh()
+        self.assertEqual([row['site_id'] for row in rows], ['site0'])
+
+    def test_requires_aggregates(self):
+        query_builder = SQLQueryBuilder(None, 'events', self.engine)
+        query_builder.select(['id'])
+        with self.assertRaises(ValueError):
+            query_builder.incremental('id')
+
+    def test_counts_rows_tied_with_watermark(self):
+        query_builder = self.get_query_builder()
+        query_builder.incremental('value', self.state_store).refresh()
+        self.insert_events([(4, 'org1', 'site1', 8)])
+        aggregator = query_builder.incremental('value', self.state_store)
+        self.assertEqual(aggregator.refresh(), self.full_result())
+        self.insert_events([(5, 'org2', 'site3', 8), (6, 'org2', 'site3', 9)])
+        self.assertEqual(aggregator.refresh(), self.full_result())
+
+    def test_engines_have_separate_state(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        other_engine = create_engine(
+            f'sqlite:///{os.path.join(directory.name, "shard.db")}',
+        )
+        with other_engine.begin() as connection:
+            connection.exec_driver_sql(
+                'CREATE TABLE events (id INTEGER PRIMARY KEY, '
+                'organization_id VARCHAR, site_id VARCHAR, value INTEGER)',
+            )
+        other_builder = SQLQueryBuilder(None, 'events', other_engine)
+        other_builder.count('id', 'total')
+        query_builder = SQLQueryBuilder(None, 'events', self.engine)
+        query_builder.count('id', 'total')
+        self.assertNotEqual(
+            self.get_aggregator(query_builder).key,
+            self.get_aggregator(other_builder).key,
+        )
+
+    def test_concurrent_refresh_does_not_double_count(self):
+        first = self.get_aggregator()
+        second = self.get_aggregator()
+        get_delta = first.get_delta
+        calls = []
+
+        def refresh_concurrently(connection, low_watermark, high_watermark):
+            # The second worker finishes its refresh while the first one
+            # is still aggregating the same delta.
+            if not calls:
+                second.refresh()
+            calls.append(low_watermark)
+            return get_delta(connection, low_watermark, high_watermark)
+
+        first.get_delta = refresh_concurrently
+        self.assertEqual(first.refresh(), self.full_result())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(
+            self.state_store.get(first.key)['watermark'],
+            3,
+        )
+
+    def test_gives_up_when_state_keeps_changing(self):
+        aggregator = self.get_aggregator()
+        aggregator.state_store.compare_and_set = lambda *args: False
+        with self.assertRaises(IncrementalStateConflictError):
+            aggregator.refresh()
+
+    def test_truncate_and_reload_rebuilds_state(self):
+        self.get_aggregator().refresh()
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql('DELETE FROM events')
+        self.assertEqual(self.get_aggregator().refresh(), [])
+        self.insert_events([(1, 'org1', 'site9', 1)])
+        aggregator = self.get_aggregator()
+        self.assertEqual(aggregator.refresh(), self.full_result())
+
+    def test_reload_with_lower_watermark_rebuilds_state(self):
+        self.get_aggregator().refresh()
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql('DELETE FROM events WHERE id > 1')
+        aggregator = self.get_aggregator()
+        self.assertEqual(aggregator.refresh(), self.full_result())
+        self.assertEqual(
+            self.state_store.get(aggregator.key)['watermark'],
+            1,
+        )
+
+    def test_compare_and_set_rejects_stale_watermark(self):
+        store = MemoryStateStore()
+        state = {'watermark': 3, 'rows': []}
+        self.assertTrue(store.compare_and_set('key', None, state))
+        self.assertFalse(store.compare_and_set('key', None, state))
+        self.assertTrue(store.compare_and_set('key', 3, state))
@@ -1,8 +1,13 @@
+import asyncio
 import unittest
+from datetime import datetime
 from unittest.mock import patch
 
 from sqlalchemy import (
     Column,
+    Date,
+    DateTime,
+    ForeignKey,
     Integer,
     MetaData,
     String,
@@ -10,6 +15,7 @@ from sqlalchemy import (
     create_engine,
     select,
 )
+from sqlalchemy.pool import StaticPool
 from rever_python_query_builder.sql_query_builder import SQLQueryBuilder
 
 
@@ -20,9 +26,19 @@ def mock_query_builder_init(schema, table_name, metadata, mock_table):
         lambda _, schema, table_name, metadata: None,
     ):
         query_builder = SQLQueryBuilder(schema, table_name, metadata)
+        query_builder.schema = None
+        query_builder.engine = metadata.bind
+        query_builder.metadata = metadata
+        query_builder.rollup_registry = None
+        query_builder.cost_guard = None
+        query_builder.timeout = None
+        query_builder.partition_column = None
         query_builder.table = mock_table
-        query_builder.query = select([mock_table])
+        query_builder.tables = {mock_table.name: mock_table}
+        query_builder.from_clause = mock_table
+        query_builder.query = select([mock_table]).select_from(mock_table)
         query_builder.selected_columns = []
+        query_builder.operations = []
     return query_builder
 
 
@@ -37,7 +53,11 @@ class TestSQLQueryBuilder(unittest.TestCase):  # noqa: WPS214
         self.table_name = 'test_table'
 
         self.metadata = MetaData()
-        self.engine = create_engine('sqlite:///:memory:')
+        self.engine = create_engine(
+            'sqlite:///:memory:',
+            connect_args={'check_same_thread': False},
+            poolclass=StaticPool,
+        )
 
         self.metadata.bind = self.engine
 
@@ -54,6 +74,23 @@ class TestSQLQueryBuilder(unittest.TestCase):  # noqa: WPS214
             Column('country_codes', String),
             Column('site_group_ids', String),
             Column('tag_group_ids', String),
+            Column('site_ref', String),
+            Column('created_at', DateTime),
+            Column('event_date', Date),
+        )
+        self.sites_table = Table(
+            'sites',
+            self.metadata,
+            Column('id', String, primary_key=True),
+            Column('name', String),
+            Column('code', String),
+        )
+        self.events_table = Table(
+            'events',
+            self.metadata,
+            Column('id', Integer, primary_key=True),
+            Column('test_table_id', Integer, ForeignKey('test_table.id')),
+            Column('kind', String),
         )
 
         self.metadata.create_all(self.engine)
@@ -325,3 +362,169 @@ class TestSQLQueryBuilder(unittest.TestCase):  # noqa: WPS214
         query_builder.apply_base_filters({'organization_id': 'org123'})
         query = compile_query(query_builder.query)
         self.assertIn("test_table.organization_id = 'org123'", query)
+
+    def test_join_on_foreign_key(self):
+        query_builder = self.mocked_query_builder
+        query_builder.join('events')
+        query_builder.select(['id', 'events.kind'])
+        query = compile_query(query_builder.query)
+        self.assertIn(
+            'FROM test_table JOIN events '
+            'ON test_table.id = events.test_table_id',
+            query,
+        )
+        self.assertIn('SELECT test_table.id, events.kind', query)
+
+    def test_join_on_configured_keys(self):
+        query_builder = self.mocked_query_builder
+        query_builder.join('sites', on=('site_id', 'id'), is_outer=True)
+        query_builder.select_column('sites.name', 'site_name')
+        query_builder.where('sites.code', '=', 'MX01')
+        query_builder.group_by('sites.name')
+        query = compile_query(query_builder.query)
+        self.assertIn(
+            'FROM test_table LEFT OUTER JOIN sites '
+            'ON test_table.site_id = sites.id',
+            query,
+        )
+        self.assertIn('sites.name AS site_name', query)
+        self.assertIn("sites.code = 'MX01'", query)
+        self.assertIn('GROUP BY sites.name', query)
+
+    def test_join_uses_class_join_keys(self):
+        query_builder = self.mocked_query_builder
+        with patch.object(
+            SQLQueryBuilder,
+            'join_keys',
+            {'sites': ('site_ref', 'code')},
+        ):
+            query_builder.join('sites')
+        query = compile_query(query_builder.query)
+        self.assertIn('ON test_table.site_ref = sites.code', query)
+
+    def test_join_multiple_tables(self):
+        query_builder = self.mocked_query_builder
+        query_builder.join('sites', on=('site_id', 'id'))
+        query_builder.join('events')
+        query_builder.select(['id'])
+        query = compile_query(query_builder.query)
+        self.assertEqual(query.count('FROM'), 1)
+        self.assertIn('JOIN sites', query)
+        self.assertIn('JOIN events', query)
+
+    def test_operations_are_recorded(self):
+        query_builder = self.mocked_query_builder
+        query_builder.where('id', '=', 1).count('id', 'total').limit(5)
+        self.assertEqual(
+            query_builder.operations,
+            [
+                ('where', ('id', '=', 1)),
+                ('count', ('id', 'total')),
+                ('limit', (5,)),
+            ],
+        )
+
+    def test_build_without_rollups(self):
+        query_builder = self.mocked_query_builder
+        query_builder.count('id', 'total')
+        self.assertIs(query_builder.build(), query_builder.query)
+
+    def test_time_range(self):
+        query_builder = self.mocked_query_builder
+        query_builder.time_range(
+            'created_at',
+            datetime(2024, 1, 1),
+            '2024-01-08T00:00:00',
+        )
+        query = compile_query(query_builder.query)
+        self.assertIn(
+            "test_table.created_at >= '2024-01-01 00:00:00.000000' AND "
+            "test_table.created_at < '2024-01-08 00:00:00.000000'",
+            query,
+        )
+        self.assertNotIn('event_date >=', query)
+
+    def test_time_range_prunes_partitions(self):
+        query_builder = self.mocked_query_builder
+        query_builder.partition_column = 'event_date'
+        query_builder.time_range(
+            'created_at',
+            datetime(2024, 1, 1, 6),
+            datetime(2024, 1, 8),
+        )
+        query = compile_query(query_builder.query)
+        self.assertIn("test_table.event_date >= '2024-01-01'", query)
+        self.assertIn("test_table.event_date < '2024-01-08'", query)
+
+    def test_time_range_partition_includes_partial_end_day(self):
+        query_builder = self.mocked_query_builder
+        query_builder.partition_column = 'event_date'
+        query_builder.time_range(
+            'created_at',
+            datetime(2024, 1, 1),
+            datetime(2024, 1, 8, 12),
+        )
+        query = compile_query(query_builder.query)
+        self.assertIn("test_table.event_date < '2024-01-09'", query)
+
+    def test_time_range_partition_bounds_use_utc(self):
+        query_builder = self.mocked_query_builder
+        query_builder.partition_column = 'event_date'
+        query_builder.time_range(
+            'created_at',
+            '2024-01-02T01:00:00+05:00',
+            '2024-01-03T03:00:00+05:00',
+        )
+        query = compile_query(query_builder.query)
+        self.assertIn("test_table.event_date >= '2024-01-01'", query)
+        self.assertIn("test_table.event_date < '2024-01-03'", query)
+
+    def test_time_range_on_partition_column(self):
+        query_builder = self.mocked_query_builder
+        query_builder.partition_column = 'event_date'
+        query_builder.time_range(
+            'event_date',
+            datetime(2024, 1, 1),
+            datetime(2024, 1, 8),
+        )
+        query = compile_query(query_builder.query)
+        self.assertIn(
+            "WHERE test_table.event_date >= '2024-01-01' AND "
+            "test_table.event_date < '2024-01-08'",
+            query,
+        )
+
+    def test_time_bucket(self):
+        query_builder = self.mocked_query_builder
+        query_builder.time_bucket('created_at', 'day').count('id', 'total')
+        query = compile_query(query_builder.query)
+        self.assertIn(
+            "SELECT date_trunc('day', test_table.created_at) AS day",
+            query,
+        )
+        self.assertIn(
+            "GROUP BY date_trunc('day', test_table.created_at)",
+            query,
+        )
+
+    def test_time_bucket_with_alias(self):
+        query_builder = self.mocked_query_builder
+        query_builder.time_bucket('created_at', 'hour', 'bucket')
+        query = compile_query(query_builder.query)
+        self.assertIn('AS bucket', query)
+
+    def test_time_bucket_invalid_granularity(self):
+        query_builder = self.mocked_query_builder
+        with self.assertRaises(ValueError):
+            query_builder.time_bucket('created_at', 'minute')
+
+    def test_execute(self):
+        query_builder = self.mocked_query_builder
+        query_builder.count('id', 'total')
+        self.assertEqual(query_builder.execute()[0].total, 0)
+
+    def test_execute_async(self):
+        query_builder = self.mocked_query_builder
+        query_builder.count('id', 'total')
+        rows = asyncio.run(query_builder.execute_async(timeout=5))
+        self.assertEqual(rows[0].total, 0)
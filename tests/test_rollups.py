@@ -0,0 +1,182 @@
+import unittest
+
+from sqlalchemy import create_engine
+
+from rever_python_query_builder.rollups import RollupRegistry, covers
+from rever_python_query_builder.sql_query_builder import SQLQueryBuilder
+
+
+def compile_query(query):
+    return str(query.compile(compile_kwargs={'literal_binds': True}))
+
+
+class TestRollups(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql(
+                'CREATE TABLE events ('
+                'id INTEGER PRIMARY KEY, organization_id VARCHAR, '
+                'site_id VARCHAR, day DATE, value INTEGER)',
+            )
+            connection.exec_driver_sql(
+                'CREATE TABLE daily_events ('
+                'organization_id VARCHAR, site_id VARCHAR, day DATE, '
+                'events_count INTEGER, value_sum INTEGER)',
+            )
+            connection.exec_driver_sql(
+                "INSERT INTO events VALUES "
+                "(1, 'org1', 'site1', '2024-01-01', 2), "
+                "(2, 'org1', 'site1', '2024-01-01', 3), "
+                "(3, 'org1', 'site2', '2024-01-02', 5), "
+                "(4, 'org2', 'site3', '2024-01-02', 7)",
+            )
+            connection.exec_driver_sql(
+                "INSERT INTO daily_events VALUES "
+                "('org1', 'site1', '2024-01-01', 2, 5), "
+                "('org1', 'site2', '2024-01-02', 1, 5), "
+                "('org2', 'site3', '2024-01-02', 1, 7)",
+            )
+        self.rollup = {
+            'table_name': 'daily_events',
+            'schema': None,
+            'source_table': 'events',
+            'dimensions': ['organization_id', 'site_id', 'day'],
+            'measures': {
+                'count(id)': 'events_count',
+                'count(value)': 'events_count',
+                'sum(value)': 'value_sum',
+            },
+        }
+        self.registry = RollupRegistry().register(self.rollup)
+
+    def get_query_builder(self):
+        return SQLQueryBuilder(
+            None,
+            'events',
+            self.engine,
+            rollup_registry=self.registry,
+        )
+
+    def fetch(self, query):
+        with self.engine.connect() as connection:
+            return connection.execute(query).fetchall()
+
+    def test_routes_compatible_query_to_rollup(self):
+        query_builder = self.get_query_builder()
+        query_builder.select_column('site_id') \
+            .count('id', 'total') \
+            .sum('value', 'total_value') \
+            .add_organization_filter('org1') \
+            .group_by('site_id') \
+            .order_by('site_id', 'asc')
+        query = query_builder.build()
+        self.assertIn('FROM daily_events', compile_query(query))
+        self.assertIn(
+            'coalesce(sum(events_count), 0) AS total',
+            compile_query(query),
+        )
+        self.assertEqual(self.fetch(query), self.fetch(query_builder.query))
+
+    def test_keeps_default_aggregate_names(self):
+        query_builder = self.get_query_builder()
+        query_builder.count('id').sum('value').count('value')
+        query = query_builder.build()
+        self.assertIn('FROM daily_events', compile_query(query))
+        with self.engine.connect() as connection:
+            routed_keys = list(connection.execute(query).keys())
+            raw_keys = list(connection.execute(query_builder.query).keys())
+        self.assertEqual(routed_keys, raw_keys)
+        self.assertEqual(routed_keys, ['count_1', 'sum_1', 'count_2'])
+
+    def test_routed_count_is_zero_without_rows(self):
+        query_builder = self.get_query_builder()
+        query_builder.count('id', 'total').add_organization_filter('nope')
+        query = query_builder.build()
+        self.assertIn('FROM daily_events', compile_query(query))
+        self.assertEqual(self.fetch(query), [(0,)])
+        self.assertEqual(self.fetch(query), self.fetch(query_builder.query))
+
+    def test_falls_back_on_unknown_dimension(self):
+        query_builder = self.get_query_builder()
+        query_builder.count('id', 'total').where('id', '>', 1)
+        self.assertIs(query_builder.build(), query_builder.query)
+
+    def test_falls_back_on_unknown_measure(self):
+        query_builder = self.get_query_builder()
+        query_builder.average('value', 'avg_value')
+        self.assertIs(query_builder.build(), query_builder.query)
+
+    def test_falls_back_without_aggregates(self):
+        query_builder = self.get_query_builder()
+        query_builder.select(['site_id'])
+        self.assertIs(query_builder.build(), query_builder.query)
+
+    def test_falls_back_on_order_by_raw_column(self):
+        query_builder = self.get_query_builder()
+        query_builder.count('id', 'total').order_by('value', 'desc')
+        self.assertIs(query_builder.build(), query_builder.query)
+
+    def test_covers_nested_expressions(self):
+        operations = [
+            ('count', ('id', None)),
+            ('complex_expression', ({
+                'operator': 'or-expression',
+                'expressions': [
+                    {'field': 'site_id', 'operator': '=', 'value': 'a'},
+                    {'field': 'id', 'operator': '=', 'value': 1},
+                ],
+            },)),
+        ]
+        self.assertFalse(covers(self.rollup, operations))
+
+    def test_prefers_coarsest_rollup(self):
+        coarse_rollup = dict(
+            self.rollup,
+            table_name='org_events',
+            dimensions=['organization_id'],
+        )
+        self.registry.register(coarse_rollup)
+        operations = [('count', ('id', None))]
+        self.assertIs(self.registry.find('events', operations), coarse_rollup)
+
+    def test_covers_aligned_time_range(self):
+        rollup = dict(self.rollup, granularity='day')
+        operations = [
+            ('count', ('id', None)),
+            ('time_range', ('day', '2024-01-01', '2024-01-03')),
+        ]
+        self.assertTrue(covers(rollup, operations))
+
+    def test_rejects_unaligned_time_range(self):
+        rollup = dict(self.rollup, granularity='day')
+        operations = [
+            ('count', ('id', None)),
+            ('time_range', ('day', '2024-01-01T06:00:00', '2024-01-03')),
+        ]
+        self.assertFalse(covers(rollup, operations))
+
+    def test_rejects_finer_time_bucket(self):
+        rollup = dict(self.rollup, granularity='day')
+        self.assertTrue(covers(rollup, [
+            ('count', ('id', None)),
+            ('time_bucket', ('day', 'week', None)),
+            ('order_by', ('week', 'asc')),
+        ]))
+        self.assertFalse(covers(rollup, [
+            ('count', ('id', None)),
+            ('time_bucket', ('day', 'hour', None)),
+        ]))
+
+    def test_routes_time_range_with_rollup_partition(self):
+        self.rollup['partition_column'] = 'day'
+        query_builder = self.get_query_builder()
+        query_builder.count('id', 'total').time_range(
+            'day',
+            '2024-01-02',
+            '2024-01-03',
+        )
+        query = compile_query(query_builder.build())
+        self.assertIn('FROM daily_events', query)
+        self.assertIn("daily_events.day >= '2024-01-02'", query)
@@ -0,0 +1,174 @@
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from rever_python_query_builder.scatter_gather import (
+    ScatterGatherExecutor,
+    get_organization_ids,
+    merge_rows,
+    sort_rows,
+)
+from rever_python_query_builder.sql_query_builder import SQLQueryBuilder
+
+
+def create_shard(rows):
+    engine = create_engine(
+        'sqlite:///:memory:',
+        connect_args={'check_same_thread': False},
+        poolclass=StaticPool,
+    )
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            'CREATE TABLE events (id INTEGER PRIMARY KEY, '
+            'organization_id VARCHAR, site_id VARCHAR, value INTEGER)',
+        )
+        for row in rows:
+            connection.exec_driver_sql(
+                'INSERT INTO events VALUES (?, ?, ?, ?)',
+                row,
+            )
+    return engine
+
+
+class TestScatterGather(unittest.TestCase):
+
+    def setUp(self):
+        self.shard_a = create_shard([
+            (1, 'org1', 'site1', 2),
+            (2, 'org1', 'site2', 4),
+            (3, 'org1', 'site1', 6),
+        ])
+        self.shard_b = create_shard([
+            (4, 'org2', 'site1', 10),
+            (5, 'org2', 'site3', 1),
+        ])
+        self.executor = ScatterGatherExecutor(
+            {'a': [self.shard_a], 'b': [self.shard_b]},
+            organization_router={'org1': 'a', 'org2': 'b'}.get,
+        )
+
+    def get_query_builder(self):
+        return SQLQueryBuilder(None, 'events', self.shard_a)
+
+    def test_merges_grouped_aggregates(self):
+        query_builder = self.get_query_builder()
+        query_builder.select_column('site_id') \
+            .count('id', 'total') \
+            .sum('value', 'total_value') \
+            .average('value', 'avg_value') \
+            .group_by('site_id') \
+            .order_by('total', 'desc') \
+            .limit(2)
+        rows = self.executor.execute(query_builder)
+        self.assertEqual(rows, [
+            {
+                'site_id': 'site1',
+                'total': 3,
+                'total_value': 18,
+                'avg_value': 6.0,
+            },
+            {
+                'site_id': 'site2',
+                'total': 1,
+                'total_value': 4,
+                'avg_value': 4.0,
+            },
+        ])
+
+    def test_merges_scalar_aggregates(self):
+        query_builder = self.get_query_builder()
+        query_builder.count('id').average('value')
+        rows = self.executor.execute(query_builder)
+        self.assertEqual(rows, [{'count_1': 5, 'avg_1': 23 / 5}])
+        self.assertEqual(
+            list(rows[0]),
+            list(query_builder.execute()[0]._mapping),
+        )
+
+    def test_reapplies_order_and_limit_on_rows(self):
+        query_builder = self.get_query_builder()
+        query_builder.select(['id', 'value']) \
+            .order_by('value', 'desc') \
+            .limit(3)
+        rows = self.executor.execute(query_builder)
+        self.assertEqual(
+            [row['value'] for row in rows],
+            [10, 6, 4],
+        )
+
+    def test_routes_by_organization(self):
+        query_builder = self.get_query_builder()
+        query_builder.add_organization_filter('org2').count('id', 'total')
+        self.assertEqual(self.executor.get_shard_names({'org2'}), ['b'])
+        rows = self.executor.execute(query_builder)
+        self.assertEqual(rows, [{'total': 2}])
+
+    def test_fails_over_to_replica(self):
+        unreachable = create_engine('sqlite:////nonexistent/dir/events.db')
+        executor = ScatterGatherExecutor({'a': [unreachable, self.shard_a]})
+        query_builder = self.get_query_builder()
+        query_builder.count('id', 'total')
+        self.assertEqual(executor.execute(query_builder), [{'total': 3}])
+
+    def test_skips_unhealthy_engines(self):
+        executor = ScatterGatherExecutor(
+            {'a': [self.shard_b, self.shard_a]},
+            health_check=lambda engine: engine is self.shard_a,
+        )
+        query_builder = self.get_query_builder()
+        query_builder.count('id', 'total')
+        self.assertEqual(executor.execute(query_builder), [{'total': 3}])
+
+    def test_get_organization_ids(self):
+        operations = [
+            ('where', ('organization_id', '=', 'org1')),
+            ('where', ('organization_id', 'in', ['org2', 'org3'])),
+            ('where', ('site_id', '=', 'site1')),
+        ]
+        self.assertEqual(
+            get_organization_ids(operations),
+            {'org1', 'org2', 'org3'},
+        )
+
+    def test_merge_first_keeps_first_value(self):
+        rows = merge_rows(
+            [
+                [{'site_id': 'a', 'first': None}],
+                [{'site_id': 'a', 'first': 3}],
+            ],
+            [('first', 'first')],
+            True,
+        )
+        self.assertEqual(rows, [{'site_id': 'a', 'first': 3}])
+
+    def test_sort_rows_matches_dialect_null_placement(self):
+        rows = [{'value': 1}, {'value': None}, {'value': 2}]
+        descending = [('order_by', ('value', 'desc'))]
+        ascending = [('order_by', ('value', 'asc'))]
+        self.assertEqual(
+            sort_rows(rows, descending, 'postgresql'),
+            [{'value': None}, {'value': 2}, {'value': 1}],
+        )
+        self.assertEqual(
+            sort_rows(rows, ascending, 'postgresql'),
+            [{'value': 1}, {'value': 2}, {'value': None}],
+        )
+        self.assertEqual(
+            sort_rows(rows, descending, 'sqlite'),
+            [{'value': 2}, {'value': 1}, {'value': None}],
+        )
+        self.assertEqual(
+            sort_rows(rows, ascending, 'sqlite'),
+            [{'value': None}, {'value': 1}, {'value': 2}],
+        )
+
+    def test_rejects_order_by_unselected_column(self):
+        query_builder = self.get_query_builder()
+        query_builder.select(['id']).order_by('value', 'desc')
+        with self.assertRaises(ValueError):
+            self.executor.execute(query_builder)
+
+    def test_rejects_empty_shards(self):
+        with self.assertRaises(ValueError):
+            ScatterGatherExecutor({})
@@ -0,0 +1,214 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from sqlalchemy import create_engine, event, text
+
+from rever_python_query_builder.exceptions import (
+    QueryCancelledError,
+    QueryTimeoutError,
+)
+from rever_python_query_builder.timeouts import (
+    CANCELLERS,
+    TIMEOUT_STATEMENTS,
+    CancellationToken,
+    cancel_cursor,
+    cancel_snowflake,
+    cancel_statement,
+    execute_with_timeout,
+    run_cancellable,
+)
+
+ENDLESS_QUERY = text(
+    'WITH RECURSIVE numbers(x) AS '
+    '(SELECT 1 UNION ALL SELECT x + 1 FROM numbers) '
+    'SELECT count(*) FROM numbers',
+)
+
+SLOW_QUERY = text(
+    'WITH RECURSIVE numbers(x) AS '
+    '(SELECT 1 UNION ALL SELECT x + 1 FROM numbers WHERE x < 1000000) '
+    'SELECT count(*) FROM numbers',
+)
+
+
+class TestTimeouts(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:')
+
+    def run_query(self, query, timeout=None, cancellation_token=None):
+        with self.engine.connect() as connection:
+            return execute_with_timeout(
+                connection,
+                query,
+                timeout,
+                cancellation_token,
+            )
+
+    def test_executes_within_timeout(self):
+        rows = self.run_query(text('SELECT 1'), timeout=5)
+        self.assertEqual(rows[0][0], 1)
+
+    def test_timeout_interrupts_statement(self):
+        started = time.monotonic()
+        with self.assertRaises(QueryTimeoutError):
+            self.run_query(ENDLESS_QUERY, timeout=0.2)
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_cancel_from_another_thread(self):
+        token = CancellationToken()
+        threading.Timer(0.2, token.cancel).start()
+        with self.assertRaises(QueryCancelledError):
+            self.run_query(ENDLESS_QUERY, cancellation_token=token)
+        self.assertIsNone(token.connection)
+
+    def test_cancelled_token_skips_execution(self):
+        token = CancellationToken()
+        token.cancel()
+        with self.assertRaises(QueryCancelledError):
+            self.run_query(text('SELECT 1'), cancellation_token=token)
+
+    def test_cancel_before_statement_starts(self):
+        token = CancellationToken()
+        statements = []
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def cancel_first(connection, cursor, statement, *args):
+            statements.append(statement)
+            if len(statements) == 1:
+                token.cancel()
+
+        with self.assertRaises(QueryCancelledError):
+            self.run_query(text('SELECT 1'), cancellation_token=token)
+
+    def test_uncancellable_statement_does_not_return_rows(self):
+        with patch.dict(CANCELLERS, {'sqlite': lambda *args: 'unsupported'}):
+            with self.assertWarns(RuntimeWarning):
+                with self.assertRaises(QueryTimeoutError):
+                    self.run_query(SLOW_QUERY, timeout=0.01)
+
+    def test_native_timeout_statements(self):
+        statements = []
+
+        @event.listens_for(self.engine, 'before_cursor_execute')
+        def record(connection, cursor, statement, *args):
+            statements.append(statement)
+
+        native_statements = {
+            'sqlite': (
+                'PRAGMA busy_timeout = {milliseconds}',
+                'PRAGMA busy_timeout = 0',
+            ),
+        }
+        with patch.dict(TIMEOUT_STATEMENTS, native_statements):
+            self.run_query(text('SELECT 1'), timeout=1.5)
+        self.assertEqual(
+            statements,
+            [
+                'PRAGMA busy_timeout = 1500',
+                'SELECT 1',
+                'PRAGMA busy_timeout = 0',
+            ],
+        )
+
+    def test_cancel_statement(self):
+        dbapi_connection = MagicMock(spec=['cancel'])
+        self.assertTrue(cancel_statement(dbapi_connection))
+        dbapi_connection.cancel.assert_called_once()
+        self.assertFalse(cancel_statement(object()))
+
+    def test_cancel_cursor_prefers_cursor(self):
+        connection = MagicMock()
+        cursor = MagicMock(spec=['cancel'])
+        self.assertEqual(cancel_cursor(connection, cursor, 'tag'), 'sent')
+        cursor.cancel.assert_called_once()
+        connection.connection.dbapi_connection.cancel.assert_not_called()
+
+    def test_cancel_snowflake_by_query_tag(self):
+        connection = MagicMock()
+        cancel_connection = (
+            connection.engine.connect.return_value.__enter__.return_value
+        )
+        result = cancel_connection.execute.return_value
+        result.fetchall.return_value = []
+        self.assertEqual(cancel_snowflake(connection, None, 'tag'), 'sent')
+        statement, params = cancel_connection.execute.call_args.args
+        self.assertIn('SYSTEM$CANCEL_QUERY', str(statement))
+        self.assertEqual(params, {'tag': 'tag'})
+        result.fetchall.return_value = [('Identified SQL statement',)]
+        self.assertEqual(
+            cancel_snowflake(connection, None, 'tag'),
+            'cancelled',
+        )
+
+    def test_cancel_is_sent_without_holding_lock(self):
+        token = CancellationToken()
+        token.bind(MagicMock())
+        dialect_name = token.connection.dialect.name
+        locked = []
+
+        def canceller(connection, cursor, tag):
+            locked.append(token.lock.locked())
+            return 'cancelled'
+
+        with patch.dict(CANCELLERS, {dialect_name: canceller}):
+            token.cancel()
+        self.assertEqual(locked, [False])
+
+    def test_stops_repeating_once_cancelled(self):
+        token = CancellationToken()
+        token.cancel_interval = 0.01
+        token.bind(MagicMock())
+        dialect_name = token.connection.dialect.name
+        outcomes = iter(['sent', 'sent', 'cancelled'])
+        calls = []
+
+        def canceller(connection, cursor, tag):
+            calls.append(tag)
+            return next(outcomes)
+
+        with patch.dict(CANCELLERS, {dialect_name: canceller}):
+            token.cancel()
+            time.sleep(0.2)
+        self.assertEqual(len(calls), 3)
+
+    def test_asyncio_cancellation_cancels_statement(self):
+        token = CancellationToken()
+
+        def run_endless_query():
+            return self.run_query(ENDLESS_QUERY, cancellation_token=token)
+
+        async def cancel_task():
+            task = asyncio.ensure_future(
+                run_cancellable(run_endless_query, token),
+            )
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_task())
+        self.assertTrue(token.cancelled)
+        self.assertIsNone(token.connection)
+
+    def test_asyncio_cancellation_cancels_off_the_loop(self):
+        token = CancellationToken()
+        cancel_threads = []
+        token.cancel = lambda: cancel_threads.append(threading.get_ident())
+
+        async def cancel_task():
+            task = asyncio.ensure_future(
+                run_cancellable(lambda: time.sleep(0.2), token),
+            )
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return threading.get_ident()
+
+        loop_thread = asyncio.run(cancel_task())
+        self.assertEqual(len(cancel_threads), 1)
+        self.assertNotEqual(cancel_threads[0], loop_thread)